@@ -35,7 +35,7 @@ setup(name='bvhtoolbox',
       python_requires='>=3',
       install_requires=['numpy',
                         'transforms3d >= 0.3.1'],
-      extras_require={'dev': ['sympy', 'panda3d', 'twine'],
+      extras_require={'dev': ['panda3d', 'twine'],
                       'test': ['pytest', 'hypothesis'],
                       },
       entry_points={'console_scripts': ['bvh2csv=bvhtoolbox.convert.bvh2csv:main',
@@ -7,9 +7,17 @@ from .bvhtransforms import get_affines,\
                            get_quaternions,\
                            get_translations, \
                            get_rotation_matrices,\
+                           get_all_rotation_matrices, \
+                           get_all_quaternions, \
+                           get_all_translations, \
                            get_motion_data, \
                            set_motion_data,\
-                           prune
+                           prune, \
+                           qmult_batch, \
+                           euler2quat_batch, \
+                           euler2mat_batch, \
+                           mat2euler_batch, \
+                           quat2euler_batch
 
 
 def get_pkg_version():
@@ -19,10 +19,8 @@
 # LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
-from itertools import repeat
 
 import numpy as np
-import transforms3d as t3d
 
 from . import BvhTree
 
@@ -36,6 +34,225 @@ _AXES2TUPLE = {
     'yxz': (1, 1), 'yxy': (1, 1), 'zxy': (2, 0),
     'zxz': (2, 0), 'zyx': (2, 1), 'zyz': (2, 1)}
 
+# Indices for converting 'xyz' order to each rotation order, computed once.
+_AXES2INDICES = {axes: (firstaxis, _NEXT_AXIS[firstaxis + parity], _NEXT_AXIS[firstaxis - parity + 1])
+                 for axes, (firstaxis, parity) in _AXES2TUPLE.items()}
+
+# Epsilon for testing whether a number is close to zero.
+_EPS4 = np.finfo(float).eps * 4.0
+
+
+def _parse_axes(axes):
+    """Decode a 4 character axes string, e.g. 'rzxy', the way transforms3d does.
+
+    :param axes: First character is 's' for static or 'r' for rotating frame, followed by the axes order.
+    :type axes: str
+    :return: firstaxis, parity, repetition, frame
+    :rtype: tuple
+    """
+    axes = axes.lower()
+    frame = int(axes[0] == 'r')
+    # A rotating frame is the static frame with reversed axes order.
+    firstaxis, parity = _AXES2TUPLE[axes[:0:-1] if frame else axes[1:]]
+    repetition = int(axes[1] == axes[3])
+    return firstaxis, parity, repetition, frame
+
+
+def qmult_batch(quats, q):
+    """Multiply all quaternions in quats with quaternion q (Hamilton product quats * q).
+
+    :param quats: wxyz quaternions (frames x 4).
+    :type quats: numpy.ndarray
+    :param q: wxyz quaternion, or one quaternion per frame (frames x 4).
+    :type q: numpy.ndarray
+    :return: wxyz quaternions (frames x 4).
+    :rtype: numpy.ndarray
+    """
+    w1, x1, y1, z1 = np.asarray(quats, dtype=float).T
+    w2, x2, y2, z2 = np.asarray(q, dtype=float).T
+    res = np.empty(np.broadcast(w1, w2).shape + (4,))
+    res[:, 0] = w1*w2 - x1*x2 - y1*y2 - z1*z2
+    res[:, 1] = w1*x2 + x1*w2 + y1*z2 - z1*y2
+    res[:, 2] = w1*y2 + y1*w2 + z1*x2 - x1*z2
+    res[:, 3] = w1*z2 + z1*w2 + x1*y2 - y1*x2
+    return res
+
+
+def _euler_from_matrix_entries(entry, axes):
+    """Return Euler angles in radians from rotation matrix entries for all frames, as transforms3d's mat2euler does.
+
+    :param entry: Function that returns the entry (row, column) of the rotation matrices for all frames.
+    :type entry: function
+    :param axes: The order of the Euler angles to return.
+    :type axes: str
+    :return: Euler angles in order of axes (frames x 3).
+    :rtype: numpy.ndarray
+    """
+    firstaxis, parity, repetition, frame = _parse_axes(axes)
+    i = firstaxis
+    j = _NEXT_AXIS[i + parity]
+    k = _NEXT_AXIS[i - parity + 1]
+    m_ii, m_jj, m_jk = entry(i, i), entry(j, j), entry(j, k)
+    eulers = np.empty((len(m_ii), 3))
+    if repetition:
+        m_ij, m_ik = entry(i, j), entry(i, k)
+        sy = np.sqrt(m_ij*m_ij + m_ik*m_ik)
+        regular = sy > _EPS4
+        eulers[:, 0] = np.where(regular, np.arctan2(m_ij, m_ik), np.arctan2(-m_jk, m_jj))
+        eulers[:, 1] = np.arctan2(sy, m_ii)
+        eulers[:, 2] = np.where(regular, np.arctan2(entry(j, i), -entry(k, i)), 0.0)
+    else:
+        m_ji = entry(j, i)
+        cy = np.sqrt(m_ii*m_ii + m_ji*m_ji)
+        regular = cy > _EPS4
+        eulers[:, 0] = np.where(regular, np.arctan2(entry(k, j), entry(k, k)), np.arctan2(-m_jk, m_jj))
+        eulers[:, 1] = np.arctan2(-entry(k, i), cy)
+        eulers[:, 2] = np.where(regular, np.arctan2(m_ji, m_ii), 0.0)
+    if parity:
+        eulers *= -1.0
+    if frame:
+        eulers = eulers[:, ::-1]
+    return eulers
+
+
+def mat2euler_batch(matrices, axes='rzxz'):
+    """Return Euler angles in radians from rotation matrices for all frames.
+    Vectorized version of transforms3d.euler.mat2euler.
+
+    :param matrices: rotation matrices or affines (frames x 3 x 3 or frames x 4 x 4).
+    :type matrices: numpy.ndarray
+    :param axes: The order of the Euler angles to return.
+    :type axes: str
+    :return: Euler angles in order of axes (frames x 3).
+    :rtype: numpy.ndarray
+    """
+    m = np.asarray(matrices, dtype=float)
+    return _euler_from_matrix_entries(lambda row, col: m[:, row, col], axes)
+
+
+def euler2quat_batch(eulers, axes='rzxz'):
+    """Return wxyz quaternions from Euler angles in radians for all frames.
+    Vectorized version of transforms3d.euler.euler2quat.
+
+    :param eulers: Euler angles in order of axes (frames x 3).
+    :type eulers: numpy.ndarray
+    :param axes: The order of the Euler angles.
+    :type axes: str
+    :return: wxyz quaternions (frames x 4).
+    :rtype: numpy.ndarray
+    """
+    firstaxis, parity, repetition, frame = _parse_axes(axes)
+    i = firstaxis + 1
+    j = _NEXT_AXIS[i + parity - 1] + 1
+    k = _NEXT_AXIS[i - parity] + 1
+    ai, aj, ak = np.asarray(eulers, dtype=float).T / 2.0
+    if frame:
+        ai, ak = ak, ai
+    if parity:
+        aj = -aj
+    ci, si = np.cos(ai), np.sin(ai)
+    cj, sj = np.cos(aj), np.sin(aj)
+    ck, sk = np.cos(ak), np.sin(ak)
+    cc, cs = ci*ck, ci*sk
+    sc, ss = si*ck, si*sk
+    quats = np.empty((len(ai), 4))
+    if repetition:
+        quats[:, 0] = cj*(cc - ss)
+        quats[:, i] = cj*(cs + sc)
+        quats[:, j] = sj*(cc + ss)
+        quats[:, k] = sj*(cs - sc)
+    else:
+        quats[:, 0] = cj*cc + sj*ss
+        quats[:, i] = cj*sc - sj*cs
+        quats[:, j] = cj*ss + sj*cc
+        quats[:, k] = cj*cs - sj*sc
+    if parity:
+        quats[:, j] *= -1.0
+    return quats
+
+
+def euler2mat_batch(eulers, axes='rzxz', out=None):
+    """Return rotation matrices from Euler angles in radians for all frames.
+    Vectorized version of transforms3d.euler.euler2mat.
+
+    :param eulers: Euler angles in order of axes (frames x 3).
+    :type eulers: numpy.ndarray
+    :param axes: The order of the Euler angles.
+    :type axes: str
+    :param out: Optional array to write the matrices to, e.g. the rotation part of affines (frames x 3 x 3).
+    :type out: numpy.ndarray
+    :return: rotation matrices (frames x 3 x 3).
+    :rtype: numpy.ndarray
+    """
+    firstaxis, parity, repetition, frame = _parse_axes(axes)
+    i = firstaxis
+    j = _NEXT_AXIS[i + parity]
+    k = _NEXT_AXIS[i - parity + 1]
+    ai, aj, ak = np.asarray(eulers, dtype=float).T
+    if frame:
+        ai, ak = ak, ai
+    if parity:
+        ai, aj, ak = -ai, -aj, -ak
+    si, sj, sk = np.sin(ai), np.sin(aj), np.sin(ak)
+    ci, cj, ck = np.cos(ai), np.cos(aj), np.cos(ak)
+    cc, cs = ci*ck, ci*sk
+    sc, ss = si*ck, si*sk
+    matrices = np.empty((len(ai), 3, 3)) if out is None else out
+    if repetition:
+        matrices[:, i, i] = cj
+        matrices[:, i, j] = sj*si
+        matrices[:, i, k] = sj*ci
+        matrices[:, j, i] = sj*sk
+        matrices[:, j, j] = -cj*ss + cc
+        matrices[:, j, k] = -cj*cs - sc
+        matrices[:, k, i] = -sj*ck
+        matrices[:, k, j] = cj*sc + cs
+        matrices[:, k, k] = cj*cc - ss
+    else:
+        matrices[:, i, i] = cj*ck
+        matrices[:, i, j] = sj*sc - cs
+        matrices[:, i, k] = sj*cc + ss
+        matrices[:, j, i] = cj*sk
+        matrices[:, j, j] = sj*ss + cc
+        matrices[:, j, k] = sj*cs - sc
+        matrices[:, k, i] = -sj
+        matrices[:, k, j] = cj*si
+        matrices[:, k, k] = cj*ci
+    return matrices
+
+
+def quat2euler_batch(quats, axes='rzxz'):
+    """Return Euler angles in radians from wxyz quaternions for all frames.
+    Vectorized version of transforms3d.euler.quat2euler.
+    Only the rotation matrix entries needed for the axes are computed, without building the matrices.
+
+    :param quats: wxyz quaternions (frames x 4).
+    :type quats: numpy.ndarray
+    :param axes: The order of the Euler angles to return.
+    :type axes: str
+    :return: Euler angles in order of axes (frames x 3).
+    :rtype: numpy.ndarray
+    """
+    w, x, y, z = np.asarray(quats, dtype=float).T
+    nq = w*w + x*x + y*y + z*z
+    # Quaternions close to zero become identity matrices, like in transforms3d.
+    s = np.divide(2.0, nq, out=np.zeros_like(nq), where=nq >= np.finfo(float).eps)
+    v = (x, y, z)
+    vs = (x*s, y*s, z*s)
+    
+    def entry(row, col):
+        # Same operations as in transforms3d.quaternions.quat2mat.
+        if row == col:
+            a, b = [axis for axis in range(3) if axis != row]
+            return 1.0 - (v[a]*vs[a] + v[b]*vs[b])
+        lo, hi = min(row, col), max(row, col)
+        k = 3 - row - col
+        if (col - row) % 3 == 1:
+            return v[lo]*vs[hi] - w*vs[k]
+        return v[lo]*vs[hi] + w*vs[k]
+    
+    return _euler_from_matrix_entries(entry, axes)
+
 
 def prune(a, epsilon=0.00000001):
     """Sets absolute values smaller than epsilon to 0.
@@ -57,7 +274,7 @@ def get_motion_data(bvh_tree):
     :return: Values for all channels for all frames.
     :rtype: numpy.ndarray
     """
-    frames = np.array(bvh_tree.frames).astype(float)
+    frames = bvh_tree.motion_data.copy()
     return frames
 
 
@@ -69,7 +286,30 @@ def set_motion_data(bvh_tree, data):
     :param data: 2d array of float values. rows are frames, columns are channels.
     :type data: numpy.ndarray
     """
-    bvh_tree.frames = data.astype(str).tolist()
+    bvh_tree.motion_data = data
+
+
+def _get_channels_data(bvh_tree, joint_name, channels):
+    """Return the values of a joint's channels for all frames, taken directly from the motion data array.
+    
+    :param bvh_tree: BVH structure.
+    :type bvh_tree: bvhtree.BvhTree
+    :param joint_name: Name of the joint.
+    :type joint_name: str
+    :param channels: Names of the channels to return, e.g. ['Xrotation', 'Yrotation', 'Zrotation'].
+    :type channels: list
+    :return: Channel values for all frames (frames x channels). Channels the joint doesn't have are 0.0.
+    :rtype: numpy.ndarray
+    """
+    channels_idx = bvh_tree.get_joint_channels_index(joint_name)
+    motion_data = bvh_tree.motion_data
+    values = np.zeros((len(motion_data), len(channels)))
+    for col, channel in enumerate(channels):
+        channel_idx = bvh_tree.get_joint_channel_index(joint_name, channel)
+        # For missing channels. bvh > v3.0!
+        if channel_idx != -1:
+            values[:, col] = motion_data[:, channels_idx + channel_idx]
+    return values
     
 
 def reorder_axes(xyz, axes='zxy'):
@@ -81,20 +321,13 @@ def reorder_axes(xyz, axes='zxy'):
     :rtype: numpy.ndarray
     """
     if xyz.shape[-1] != 3 or len(xyz.shape) > 2:
-        print("ERROR: Frames must be 1D or 2D array with 3 columns for x,y,z axes!")
-        raise ValueError
+        raise ValueError("Frames must be 1D or 2D array with 3 columns for x,y,z axes, got shape {}.".format(xyz.shape))
     # If the output order is the same as the input, do not reorder.
     if axes == 'xyz':
         return xyz
     
-    i, j, k = _get_reordered_indices(axes)
-    # 1-D arrays.
-    if len(xyz.shape) == 1:
-        res = np.array([xyz[i], xyz[j], xyz[k]])
-    # 2-D arrays: multiple frames.
-    elif len(xyz.shape) == 2:
-        # Todo: is something like data[:,1], data[:,2] = data[:,2], data[:,1].copy() faster/more efficient?
-        res = np.array([xyz[:, i], xyz[:, j], xyz[:, k]]).T
+    # Gather the columns in a single indexing operation. Works for 1-D and 2-D arrays.
+    res = xyz[..., list(_get_reordered_indices(axes))]
     return res
 
 
@@ -107,14 +340,9 @@ def _get_reordered_indices(rotation_order):
     :rtype: tuple
     """
     try:
-        firstaxis, parity = _AXES2TUPLE[rotation_order]
+        return _AXES2INDICES[rotation_order]
     except KeyError:
-        print("Rotation order must be one of {}.".format(', '.join(_AXES2TUPLE.keys())))
-        raise
-    i = firstaxis
-    j = _NEXT_AXIS[i + parity]
-    k = _NEXT_AXIS[i - parity + 1]
-    return i, j, k
+        raise KeyError("Rotation order must be one of {}.".format(', '.join(_AXES2TUPLE.keys())))
 
 
 def get_euler_angles(bvh_tree, joint_name, axes='zxy'):
@@ -128,8 +356,7 @@ def get_euler_angles(bvh_tree, joint_name, axes='zxy'):
     :return: Euler angles in order of axes (frames x 3).
     :rtype: numpy.ndarray
     """
-    euler_xyz = np.array(bvh_tree.frames_joint_channels(joint_name, ['Xrotation', 'Yrotation', 'Zrotation'],
-                                                        value=0.0))  # For missing channels. bvh > v3.0!
+    euler_xyz = _get_channels_data(bvh_tree, joint_name, ['Xrotation', 'Yrotation', 'Zrotation'])
     euler_ordered = reorder_axes(euler_xyz, axes)
     return euler_ordered
 
@@ -143,11 +370,14 @@ def get_quaternions(bvh_tree, joint_name, axes='rzxz'):
     :type joint_name: str
     :param axes: The order in which to parse the Euler angles. Usually that's the joint's channel order.
     :type axes: str
-    :return: quaternion wxyz for all frames (frames x 4).
+    :return: quaternion wxyz for all frames (frames x 4), C-contiguous float64.
     :rtype: numpy.ndarray
     """
-    eulers = np.radians(get_euler_angles(bvh_tree, joint_name, axes[1:]))
-    quaternions = np.array(list(map(t3d.euler.euler2quat, eulers[:, 0], eulers[:, 1], eulers[:, 2], repeat(axes))))
+    eulers = get_euler_angles(bvh_tree, joint_name, axes[1:])
+    # The angles are a new array, so convert them in-place.
+    np.radians(eulers, out=eulers)
+    # Plain C-contiguous float array, so that column slices are cheap views for batched operations.
+    quaternions = np.ascontiguousarray(euler2quat_batch(eulers, axes), dtype=np.float64)
     #prune(quaternions)
     return quaternions
     
@@ -164,12 +394,107 @@ def get_rotation_matrices(bvh_tree, joint_name, axes='rzxz'):
     :return: rotation matrix (frames x 3 x 3)
     :rtype: numpy.ndarray
     """
-    eulers = np.radians(get_euler_angles(bvh_tree, joint_name, axes[1:]))
-    matrices = np.array(list(map(t3d.euler.euler2mat, eulers[:, 0], eulers[:, 1], eulers[:, 2], repeat(axes))))
+    eulers = get_euler_angles(bvh_tree, joint_name, axes[1:])
+    # The angles are a new array, so convert them in-place.
+    np.radians(eulers, out=eulers)
+    matrices = euler2mat_batch(eulers, axes)
     prune(matrices)
     return matrices
 
 
+def _get_rotation_order(bvh_tree, joint_name):
+    """Return the rotating frame rotation order of a joint's channels, e.g. 'rzxy'.
+    Axes without a rotation channel are appended. Their angles are 0, so where they go doesn't change the rotation.
+
+    :param bvh_tree: BVH structure.
+    :type bvh_tree: bvhtree.BvhTree
+    :param joint_name: Name of the joint.
+    :type joint_name: str
+    :return: Rotation order.
+    :rtype: str
+    """
+    order = ''.join([channel[:1].lower() for channel in bvh_tree.joint_channels(joint_name)
+                     if channel[1:] == 'rotation'])
+    order += ''.join([axis for axis in 'xyz' if axis not in order])
+    return 'r' + order
+
+
+def _get_all_euler_angles(bvh_tree, joint_names, axes=None):
+    """Gather the Euler angles of several joints and group the joints by rotation order.
+    
+    :param bvh_tree: BVH structure.
+    :type bvh_tree: bvhtree.BvhTree
+    :param joint_names: Names of the joints.
+    :type joint_names: list
+    :param axes: Rotation order for all joints. If None, each joint's order is taken from its channels.
+    :type axes: str
+    :return: Euler angles in radians (joints x frames x 3) and joint indices for each rotation order.
+    :rtype: tuple
+    """
+    # Column of each joint's angles in the motion data, -1 for missing channels.
+    columns = np.empty((len(joint_names), 3), dtype=int)
+    groups = dict()
+    for idx, joint_name in enumerate(joint_names):
+        joint_axes = _get_rotation_order(bvh_tree, joint_name) if axes is None else axes
+        groups.setdefault(joint_axes, list()).append(idx)
+        channels_idx = bvh_tree.get_joint_channels_index(joint_name)
+        xyz_columns = [bvh_tree.get_joint_channel_index(joint_name, channel)
+                       for channel in ['Xrotation', 'Yrotation', 'Zrotation']]
+        xyz_columns = [channels_idx + col if col != -1 else -1 for col in xyz_columns]
+        columns[idx] = [xyz_columns[i] for i in _get_reordered_indices(joint_axes[1:])]
+    # Gather the angles of all joints at once (frames x joints x 3).
+    eulers = bvh_tree.motion_data[:, columns]
+    # For missing channels. bvh > v3.0!
+    eulers[:, columns == -1] = 0.0
+    np.radians(eulers, out=eulers)
+    return eulers.swapaxes(0, 1), groups
+
+
+def get_all_rotation_matrices(bvh_tree, joint_names=None):
+    """Return rotation matrices of several joints for all frames.
+    Each joint's rotation order is taken from its channels. Joints with the same order are converted in one batch.
+    Missing rotation channels are treated as 0 degrees.
+
+    :param bvh_tree: BVH structure.
+    :type bvh_tree: bvhtree.BvhTree
+    :param joint_names: Names of the joints. Defaults to all joints without End Sites.
+    :type joint_names: list
+    :return: rotation matrices (joints x frames x 3 x 3)
+    :rtype: numpy.ndarray
+    """
+    if joint_names is None:
+        joint_names = bvh_tree.get_joints_names()
+    eulers, groups = _get_all_euler_angles(bvh_tree, joint_names)
+    matrices = np.empty(eulers.shape + (3,))
+    for axes, group in groups.items():
+        matrices[group] = euler2mat_batch(eulers[group].reshape(-1, 3), axes).reshape(len(group), -1, 3, 3)
+    prune(matrices)
+    return matrices
+
+
+def get_all_quaternions(bvh_tree, joint_names=None, axes=None):
+    """Get the wxyz quaternion representations of several joints for all frames.
+    Joints with the same rotation order are converted in one batch. Missing rotation channels are treated as 0 degrees.
+    
+    :param bvh_tree: BVH structure.
+    :type bvh_tree: bvhtree.BvhTree
+    :param joint_names: Names of the joints. Defaults to all joints without End Sites.
+    :type joint_names: list
+    :param axes: The order in which to parse the Euler angles for all joints.
+    If None, each joint's rotation order is taken from its channels.
+    :type axes: str
+    :return: quaternions wxyz (joints x frames x 4).
+    :rtype: numpy.ndarray
+    """
+    if joint_names is None:
+        joint_names = bvh_tree.get_joints_names()
+    eulers, groups = _get_all_euler_angles(bvh_tree, joint_names, axes)
+    quaternions = np.empty(eulers.shape[:2] + (4,))
+    for group_axes, group in groups.items():
+        quaternions[group] = euler2quat_batch(eulers[group].reshape(-1, 3), group_axes).reshape(len(group), -1, 4)
+    return quaternions
+
+
 def get_translations(bvh_tree, joint_name):
     """Get the xyz translation of a joint for all frames.
     
@@ -180,8 +505,25 @@ def get_translations(bvh_tree, joint_name):
     :return: translations xyz for all frames (frames x 3).
     :rtype: numpy.ndarray
     """
-    translations = np.array(bvh_tree.frames_joint_channels(joint_name, ['Xposition', 'Yposition', 'Zposition'],
-                                                           value=0.0))  # For missing channels. bvh > v3.0!
+    translations = _get_channels_data(bvh_tree, joint_name, ['Xposition', 'Yposition', 'Zposition'])
+    return translations
+
+
+def get_all_translations(bvh_tree, joint_names=None):
+    """Get the xyz translations of several joints for all frames.
+    
+    :param bvh_tree: BVH structure.
+    :type bvh_tree: bvhtree.BvhTree
+    :param joint_names: Names of the joints. Defaults to all joints without End Sites.
+    :type joint_names: list
+    :return: translations xyz (joints x frames x 3).
+    :rtype: numpy.ndarray
+    """
+    if joint_names is None:
+        joint_names = bvh_tree.get_joints_names()
+    translations = np.empty((len(joint_names), len(bvh_tree.motion_data), 3))
+    for idx, joint_name in enumerate(joint_names):
+        translations[idx] = get_translations(bvh_tree, joint_name)
     return translations
     
     
@@ -197,13 +539,18 @@ def get_affines(bvh_tree, joint_name, axes='rzxz'):
     :return: affine matrix (frames x 4 x 4)
     :rtype: numpy.ndarray
     """
-    translations = get_translations(bvh_tree, joint_name)
-    rot_matrices = get_rotation_matrices(bvh_tree, joint_name, axes=axes)
+    eulers = get_euler_angles(bvh_tree, joint_name, axes[1:])
+    # The angles are a new array, so convert them in-place.
+    np.radians(eulers, out=eulers)
     
-    affine_matrices = np.array(list(map(t3d.affines.compose,
-                                        translations,
-                                        rot_matrices,
-                                        np.ones((bvh_tree.nframes, 3)))))
+    # Compose the affines without zooms and shears in a single buffer.
+    affine_matrices = np.zeros((len(eulers), 4, 4))
+    # Write rotations and translations directly into the affines.
+    rot_matrices = affine_matrices[:, :3, :3]
+    euler2mat_batch(eulers, axes, out=rot_matrices)
+    prune(rot_matrices)
+    affine_matrices[:, :3, 3] = get_translations(bvh_tree, joint_name)
+    affine_matrices[:, 3, 3] = 1.0
     return affine_matrices
 
 
@@ -20,19 +20,96 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
 
-from . import Bvh
+import numpy as np
+
+from . import Bvh, BvhNode
 
 
 class BvhTree(Bvh, object):  # Bvh is an old-style class, so we need object to fix super() in Python 2.x.
     """Extend the Bvh class with functions including End Sites and writing to file."""
 
     def __init__(self, data):
+        # Lazily filled lookup tables. See clear_caches().
+        self._channels = None
+        self._channels_index = None
+        self._joints = dict()
+        self._joints_by_name = None
+        self._joint_indices = dict()
+        self._joint_depths = None
+        self._joint_children = None
+        self._motion_data = None
         super(BvhTree, self).__init__(data)
         # Rename End Sites.
         end_sites = self.search('End')
         for end in end_sites:
             end.value[1] = end.parent.name + "_End"
     
+    @property
+    def frames(self):
+        """Channel values for each frame as lists of strings."""
+        # Values set as an array are only converted to strings when they're needed, e.g. for writing.
+        if self._frames is None:
+            self._frames = self._motion_data.astype(str).tolist()
+        return self._frames
+    
+    @frames.setter
+    def frames(self, frames):
+        self._frames = frames
+        # Parsed values are outdated.
+        self._motion_data = None
+    
+    @property
+    def motion_data(self):
+        """Channel values for all frames as float array (frames x channels).
+        The array is cached, don't change it in-place. Assign to motion_data or frames instead.
+        
+        :rtype: numpy.ndarray
+        """
+        if self._motion_data is None:
+            if self._channels is None:
+                self._build_channels_cache()
+            num_channels = sum(len(channels) for channels in self._channels.values())
+            # Make sure each frame has a value for each channel. Values are not to be shifted into another frame.
+            for idx, frame in enumerate(self.frames, start=1):
+                if len(frame) != num_channels:
+                    raise ValueError("Frame {} has {} values instead of {}.".format(idx, len(frame), num_channels))
+            # Convert all values at once. Raises ValueError for values that aren't numbers.
+            self._motion_data = np.array(self.frames, dtype=float).reshape(len(self.frames), num_channels)
+        return self._motion_data
+    
+    @motion_data.setter
+    def motion_data(self, data):
+        # Keep a copy, so later changes to data by the caller don't affect the tree.
+        self._motion_data = np.array(data, dtype=float)
+        # String values are outdated.
+        self._frames = None
+    
+    def tokenize(self):
+        """Parse the hierarchy line by line and split the values in the motion section into frames."""
+        lines = self.data.splitlines()
+        node_stack = [self.root]
+        node = None
+        line_idx = 0
+        for line_idx, line in enumerate(lines, start=1):
+            item = line.split()
+            if not item:
+                continue
+            key = item[0]
+            if key == '{':
+                node_stack.append(node)
+            elif key == '}':
+                node_stack.pop()
+            else:
+                node = BvhNode(item)
+                node_stack[-1].add_child(node)
+            if key == 'Frame' and item[1] == 'Time:':
+                break
+        else:
+            return
+        
+        # The values are converted to floats in bulk when motion_data is first needed.
+        self.frames = [line.split() for line in lines[line_idx:] if not line.isspace() and line]
+    
     def get_joints_names(self, end_sites=False):
         """
         :param end_sites: Whether to include End Sites.
@@ -40,19 +117,7 @@ class BvhTree(Bvh, object):  # Bvh is an old-style class, so we need object to f
         :return: List of joint names as strings.
         :rtype: list
         """
-        joints = []
-    
-        def iterate_joints(joint):
-            joints.append(joint.value[1])
-            if end_sites:
-                end = list(joint.filter('End'))
-                if end:
-                    joints.append(end[0].value[1])  # There can be only one End Site per joint.
-            for child in joint.filter('JOINT'):
-                iterate_joints(child)
-    
-        iterate_joints(next(self.root.filter('ROOT')))
-        return joints
+        return [joint.value[1] for joint in self._get_joints_cached(end_sites)]
 
     def get_joints(self, end_sites=False):
         """
@@ -61,42 +126,158 @@ class BvhTree(Bvh, object):  # Bvh is an old-style class, so we need object to f
         :return: List of joints as BvhNodes.
         :rtype: list
         """
+        # Return a copy, so the cache can't be altered by the caller.
+        return list(self._get_joints_cached(end_sites))
+    
+    def _get_joints_cached(self, end_sites=False):
+        """Traverse the hierarchy only once for each kind of joint list.
+        
+        :param end_sites: Whether to include End Sites.
+        :type end_sites: bool
+        :return: List of joints as BvhNodes. Don't alter it.
+        :rtype: list
+        """
+        end_sites = bool(end_sites)
+        if end_sites in self._joints:
+            return self._joints[end_sites]
+        
         joints = []
-
-        def iterate_joints(joint):
+        # Depth-first traversal with an explicit stack, looking at each joint's children only once.
+        stack = [next(self.root.filter('ROOT'))]
+        while stack:
+            joint = stack.pop()
             joints.append(joint)
-            if end_sites:
-                end = list(joint.filter('End'))
-                if end:
-                    joints.append(end[0])  # There can be only one End Site per joint.
-            for child in joint.filter('JOINT'):
-                iterate_joints(child)
-                
-        iterate_joints(next(self.root.filter('ROOT')))
+            end = None
+            children = []
+            for child in joint:
+                key = child.value[0]
+                if key == 'JOINT':
+                    children.append(child)
+                elif key == 'End' and end is None:
+                    end = child  # There can be only one End Site per joint.
+            if end_sites and end is not None:
+                joints.append(end)
+            stack.extend(reversed(children))
+        self._joints[end_sites] = joints
         return joints
     
+    def clear_caches(self):
+        """Discard cached lookups. Call this after changing the hierarchy, e.g. adding channels to a joint."""
+        self._channels = None
+        self._channels_index = None
+        self._joints = dict()
+        self._joints_by_name = None
+        self._joint_indices = dict()
+        self._joint_depths = None
+        self._joint_children = None
+    
+    def _build_channels_cache(self):
+        """Map each joint's name to its channel names and the index of its first channel in a frame."""
+        self._channels = dict()
+        self._channels_index = dict()
+        index = 0
+        for joint in self.get_joints():
+            channels = joint['CHANNELS']
+            self._channels[joint.name] = channels[1:]
+            self._channels_index[joint.name] = index
+            index += int(channels[0])
+    
+    def joint_channels(self, name):
+        """
+        :param name: Name of the joint.
+        :type name: str
+        :return: List of channel names.
+        :rtype: list
+        """
+        if self._channels is None:
+            self._build_channels_cache()
+        try:
+            # Return a copy, so the cache can't be altered by the caller.
+            return list(self._channels[name])
+        except KeyError:
+            return super(BvhTree, self).joint_channels(name)
+    
+    def get_joint_channels_index(self, joint_name):
+        """
+        :param joint_name: Name of the joint.
+        :type joint_name: str
+        :return: Index of the joint's first channel in a frame.
+        :rtype: int
+        """
+        if self._channels_index is None:
+            self._build_channels_cache()
+        try:
+            return self._channels_index[joint_name]
+        except KeyError:
+            raise LookupError('joint not found')
+    
+    def get_joint_channel_index(self, joint, channel):
+        """
+        :param joint: Name of the joint.
+        :type joint: str
+        :param channel: Name of the channel, e.g. 'Xrotation'.
+        :type channel: str
+        :return: Index of the channel within the joint's channels, -1 if the joint doesn't have this channel.
+        :rtype: int
+        """
+        if self._channels is None:
+            self._build_channels_cache()
+        try:
+            channels = self._channels[joint]
+        except KeyError:
+            channels = super(BvhTree, self).joint_channels(joint)
+        if channel in channels:
+            return channels.index(channel)
+        return -1
+    
     def get_joint(self, name):
-        found = self.search('ROOT', name)
-        if not found:
-            found = self.search('JOINT', name)
-        if not found:
-            found = self.search('End', name)
-        if found:
-            return found[0]
-        raise LookupError('joint not found')
+        if self._joints_by_name is None:
+            joints = self._get_joints_cached(end_sites=True)
+            self._joints_by_name = dict()
+            # Same precedence as searching for ROOT, then JOINT, then End, with the first match winning.
+            for kind in ('End', 'JOINT', 'ROOT'):
+                for joint in reversed(joints):
+                    if joint.value[0] == kind:
+                        self._joints_by_name[joint.value[1]] = joint
+        try:
+            return self._joints_by_name[name]
+        except KeyError:
+            raise LookupError('joint not found')
+    
+    def _get_joint_indices(self, end_sites=False):
+        """
+        :param end_sites: Whether End Sites are counted.
+        :type end_sites: bool
+        :return: Index of each joint as BvhNode in the list of joints. Don't alter it.
+        :rtype: dict
+        """
+        end_sites = bool(end_sites)
+        if end_sites not in self._joint_indices:
+            self._joint_indices[end_sites] = {joint: index for index, joint
+                                              in enumerate(self._get_joints_cached(end_sites))}
+        return self._joint_indices[end_sites]
     
     def get_joint_index(self, name):
-        return self.get_joints(end_sites=True).index(self.get_joint(name))
+        return self._get_joint_indices(end_sites=True)[self.get_joint(name)]
+    
+    def joint_parent_index(self, name):
+        joint = self.get_joint(name)
+        if joint.parent is self.root:
+            return -1
+        # The parent's index among joints without End Sites.
+        return self._get_joint_indices()[joint.parent]
     
     def joint_children(self, name):
         """Return direct child joints or End Site."""
-        joint = self.get_joint(name)
-        children = list()
-        for child in joint.filter('JOINT'):
-            children.append(child)
-        for child in joint.filter('End'):  # There's maximum 1 End Site as child.
-            children.append(child)
-        return children
+        if self._joint_children is None:
+            self._joint_children = dict()
+            # Look at each joint's children only once.
+            for joint in self._get_joints_cached(end_sites=True):
+                children = [child for child in joint if child.value[0] == 'JOINT']
+                children.extend(child for child in joint if child.value[0] == 'End')  # There's maximum 1 End Site as child.
+                self._joint_children[joint] = children
+        # Return a copy, so the cache can't be altered by the caller.
+        return list(self._joint_children[self.get_joint(name)])
         
     def write_file(self, file_path):
         """
@@ -118,59 +299,61 @@ class BvhTree(Bvh, object):  # Bvh is an old-style class, so we need object to f
         out_stream.write(self._get_motion_string())
 
     def _get_hierarchy_string(self):
-        s = 'HIERARCHY\n'
-        for joint in self.get_joints(end_sites=True):
-            s = self._close_scopes(s, self.get_joint_depth(joint.name))
-            s += self._get_joint_string(joint)
-        s = self._close_scopes(s)
-        return s
+        parts = ['HIERARCHY\n']
+        depths = self._get_joint_depths()
+        open_depth = 0
+        for joint in self._get_joints_cached(end_sites=True):
+            depth = depths[joint]
+            parts.append(self._close_scopes(open_depth, depth))
+            parts.append(self._get_joint_string(joint, depth))
+            # An End Site closes its own scope, a joint's scope stays open for its children.
+            open_depth = depth if not self.joint_children(joint.name) else depth + 1
+        parts.append(self._close_scopes(open_depth))
+        return ''.join(parts)
 
     def get_joint_depth(self, name):
         # How deep in the tree are we?
-        depth = 0
-        parent = self.joint_parent(name)
-        while parent:
-            depth += 1
-            parent = self.joint_parent(parent.name)
-        return depth
+        return self._get_joint_depths()[self.get_joint(name)]
+    
+    def _get_joint_depths(self):
+        """Compute the depth of all joints in one pass.
         
-    def _get_joint_string(self, joint):
-        depth = self.get_joint_depth(joint.name)
+        :return: Depth in the hierarchy for each joint and End Site as BvhNode. The root has depth 0.
+        :rtype: dict
+        """
+        if self._joint_depths is None:
+            self._joint_depths = dict()
+            # Joints are in depth-first order, so each parent's depth is known before its children's.
+            for joint in self._get_joints_cached(end_sites=True):
+                self._joint_depths[joint] = 0 if joint.parent is self.root else self._joint_depths[joint.parent] + 1
+        return self._joint_depths
         
+    def _get_joint_string(self, joint, depth):
+        indent = '  ' * depth
         if not self.joint_children(joint.name):
-            s = '{0}{1}\n'.format('  ' * depth, 'End Site')
-            s += '{0}{{\n'.format('  ' * depth)
-            s += '{0}{1} {2}\n'.format('  ' * (depth+1), 'OFFSET', ' '.join(joint['OFFSET']))
-            s += '{0}}}\n'.format('  ' * depth)
+            s = '{0}End Site\n{0}{{\n{0}  OFFSET {1}\n{0}}}\n'.format(indent, ' '.join(joint['OFFSET']))
         else:
-            s = '{0}{1}\n'.format('  ' * depth, str(joint))
-            s += '{0}{{\n'.format('  ' * depth)
-            for attribute in ['OFFSET', 'CHANNELS']:
-                s += '{0}{1} {2}\n'.format('  ' * (depth + 1), attribute, ' '.join(joint[attribute]))
+            s = '{0}{1}\n{0}{{\n{0}  OFFSET {2}\n{0}  CHANNELS {3}\n'.format(indent, str(joint),
+                                                                       ' '.join(joint['OFFSET']),
+                                                                       ' '.join(joint['CHANNELS']))
         return s
     
-    def _close_scopes(self, hierarchy_string, target_depth=0):
-        """ The string is hierarchically ordered. This function appends curly brackets to close open scopes.
-        It takes the indentation of the last closed bracket as reference for the current level/depth of the hierarchy.
-        :param hierarchy_string:
-        :type hierarchy_string: str
+    def _close_scopes(self, open_depth, target_depth=0):
+        """ The hierarchy is written depth-first. This function returns curly brackets to close open scopes.
+        :param open_depth: The depth of the innermost open scope.
+        :type open_depth: int
         :param target_depth: The depth determines the target indentation.
         :type target_depth: int
-        :return: string with closed scopes.
+        :return: string with closing brackets.
         :rtype: str
         """
-        # Get the last level by counting the spaces to the second to last line break.
-        last_depth = hierarchy_string[hierarchy_string[:-1].rfind("\n"):].count("  ")
-        diff = last_depth - target_depth
-        for depth in range(diff):
-            hierarchy_string += '{0}}}\n'.format('  ' * (last_depth - depth - 1))
-        return hierarchy_string
+        return ''.join('{0}}}\n'.format('  ' * depth) for depth in range(open_depth - 1, target_depth - 1, -1))
 
     def _get_motion_string(self):
-        s = 'MOTION\n'
-        s += 'Frames: {}\n'.format(self.nframes)
-        s += 'Frame Time: {}\n'.format(self.frame_time)
-        for frame in self.frames:
-            s += ' '.join(frame)
-            s += '\n'
-        return s
+        lines = ['MOTION',
+                 'Frames: {}'.format(self.nframes),
+                 'Frame Time: {}'.format(self.frame_time)]
+        lines.extend(' '.join(frame) for frame in self.frames)
+        # Join once instead of growing the string frame by frame.
+        lines.append('')
+        return '\n'.join(lines)
@@ -30,39 +30,85 @@ The degrees of freedom in the joints are written in the order they appear in the
 
 import os
 import sys
+import csv
 import argparse
 from multiprocessing import freeze_support
 
 import numpy as np
-import transforms3d as t3d
 
 from .. import get_pkg_version
 from .. import BvhTree
-from .. import get_affines
-from .multiprocess import get_bvh_files, parallelize
+from .. import get_all_rotation_matrices, get_translations
+from .multiprocess import get_bvh_files, parallelize, add_jobs_argument
 
+# Writing CSV files in large blocks.
+_WRITE_BUFFER_SIZE = 1 << 20
+_ROWS_PER_BLOCK = 10000
 
-def write_joint_rotations(bvh_tree, filepath):
+
+def _write_csv(filepath, data, header, fmt='%10.5f'):
+    """Write a 2D float array to a CSV file with a header line.
+    Same output as numpy.savetxt with delimiter=',' and comments='', but all rows are formatted in one go.
+
+    :param filepath: Destination file path for CSV file.
+    :type filepath: str
+    :param data: 2D array of values. Rows are frames, columns are channels.
+    :type data: numpy.ndarray
+    :param header: Column names.
+    :type header: list
+    :param fmt: Format for a single value.
+    :type fmt: str
+    """
+    row_fmt = ','.join([fmt] * data.shape[1]) + '\n'
+    with open(filepath, 'wb', buffering=_WRITE_BUFFER_SIZE) as file_handle:
+        file_handle.write((','.join(header) + '\n').encode())
+        # Format blocks of rows, so the text of huge files doesn't have to be held in memory all at once.
+        for start in range(0, data.shape[0], _ROWS_PER_BLOCK):
+            block = data[start:start + _ROWS_PER_BLOCK]
+            file_handle.write(((row_fmt * block.shape[0]) % tuple(block.ravel().tolist())).encode())
+
+
+def get_time_column(bvh_tree):
+    """Return the time in seconds of each frame.
+
+    :param bvh_tree: BVH tree that holds the data.
+    :type bvh_tree: BvhTree
+    :return: Time of each frame (frames x 1).
+    :rtype: numpy.ndarray
+    """
+    # Multiply instead of using a float step, which can produce one frame too many or too few.
+    return (np.arange(bvh_tree.nframes, dtype=np.float64) * bvh_tree.frame_time)[:, None]
+
+
+def write_joint_rotations(bvh_tree, filepath, time_col=None):
     """Write joints' rotation data to a CSV file.
 
     :param bvh_tree: BVH tree that holds the data.
     :type bvh_tree: BvhTree
     :param filepath: Destination file path for CSV file.
     :type filepath: str
+    :param time_col: Time of each frame (frames x 1). Computed from the BVH tree if not given.
+    :type time_col: numpy.ndarray
     :return: If the write process was successful or not.
     :rtype: bool
     """
-    time_col = np.arange(0, (bvh_tree.nframes - 0.5)*bvh_tree.frame_time, bvh_tree.frame_time)[:, None]
-    data_list = [time_col]
     header = ['time']
+    col_idx = list()
     for joint in bvh_tree.get_joints():
         channels = [channel for channel in bvh_tree.joint_channels(joint.name) if channel[1:] == 'rotation']
         header.extend(['{}.{}'.format(joint.name, channel[:1].lower()) for channel in channels])
-        data_list.append(np.array(bvh_tree.frames_joint_channels(joint.name, channels)))
-        
-    data = np.concatenate(data_list, axis=1)
+        joint_index = bvh_tree.get_joint_channels_index(joint.name)
+        col_idx.extend(joint_index + bvh_tree.get_joint_channel_index(joint.name, channel) for channel in channels)
+    
+    # Copy all rotation columns at once into a preallocated buffer.
+    data = np.empty((bvh_tree.nframes, 1 + len(col_idx)))
+    if time_col is None:
+        time_col = get_time_column(bvh_tree)
+    data[:, 0] = time_col.ravel()
+    # Gather straight from the cached motion data. It is only read, so no copy is needed first.
+    data[:, 1:] = bvh_tree.motion_data[:, np.array(col_idx, dtype=np.intp)]
     try:
-        np.savetxt(filepath, data, header=','.join(header), fmt='%10.5f', delimiter=',', comments='')
+        _write_csv(filepath, data, header)
         return True
     except IOError as e:
         print("ERROR({}): Could not write to file {}.\n"
@@ -70,7 +116,7 @@ def write_joint_rotations(bvh_tree, filepath):
         return False
     
 
-def write_joint_positions(bvh_tree, filepath, scale=1.0, end_sites=False):
+def write_joint_positions(bvh_tree, filepath, scale=1.0, end_sites=False, time_col=None):
     """Write joints' world positional data to a CSV file.
     
     :param bvh_tree: BVH tree that holds the data.
@@ -81,47 +127,55 @@ def write_joint_positions(bvh_tree, filepath, scale=1.0, end_sites=False):
     :type scale: float
     :param end_sites: Include BVH End Sites in position CSV.
     :type end_sites: bool
+    :param time_col: Time of each frame (frames x 1). Computed from the BVH tree if not given.
+    :type time_col: numpy.ndarray
     :return: If the write process was successful or not.
     :rtype: bool
     """
-    time_col = np.arange(0, (bvh_tree.nframes - 0.5) * bvh_tree.frame_time, bvh_tree.frame_time)[:, None]
-    data_list = [time_col]
-    header = ['time']
-    root = next(bvh_tree.root.filter('ROOT'))
+    joints = bvh_tree.get_joints(end_sites=end_sites)
+    n_joints = len(joints)
+    joint_ids = {joint.name: idx for idx, joint in enumerate(joints)}
+    # The root comes first and has no parent.
+    parent_ids = np.array([-1] + [joint_ids[joint.parent.name] for joint in joints[1:]])
+    depths = np.zeros(n_joints, dtype=int)
+    for idx in range(1, n_joints):
+        depths[idx] = depths[parent_ids[idx]] + 1
     
-    def get_world_positions(joint):
-        if joint.value[0] == 'End':
-            joint.world_transforms = np.tile(t3d.affines.compose(np.zeros(3), np.eye(3), np.ones(3)),
-                                             (bvh_tree.nframes, 1, 1))
+    # Local rotations and translations of all joints for all frames.
+    # Only the translation column of the world transforms is needed, so skip the bottom row of the affines.
+    # End Sites have no rotation and no children, so their rotations are never set nor used.
+    is_end = np.array([joint.value[0] == 'End' for joint in joints])
+    rotations = np.empty((n_joints, bvh_tree.nframes, 3, 3))
+    positions = np.empty((n_joints, bvh_tree.nframes, 3))
+    header = ['time']
+    # Joints with the same rotation order are converted together.
+    rotations[~is_end] = get_all_rotation_matrices(bvh_tree, [joint.name for joint in joints if joint.value[0] != 'End'])
+    for idx, joint in enumerate(joints):
+        if idx == 0:
+            positions[idx] = get_translations(bvh_tree, joint.name)
         else:
-            channels = bvh_tree.joint_channels(joint.name)
-            axes_order = ''.join([ch[:1] for ch in channels if ch[1:] == 'rotation']).lower()  # FixMe: This isn't going to work when not all rotation channels are present
-            axes_order = 's' + axes_order[::-1]
-            joint.world_transforms = get_affines(bvh_tree, joint.name, axes=axes_order)
-            
-        if joint != root:
             # For joints substitute position for offsets.
-            offset = [float(o) for o in joint['OFFSET']]
-            joint.world_transforms[:, :3, 3] = offset
-            joint.world_transforms = np.matmul(joint.parent.world_transforms, joint.world_transforms)
-        if scale != 1.0:
-            joint.world_transforms[:, :3, 3] *= scale
-            
+            positions[idx] = [float(o) for o in joint['OFFSET']]
         header.extend(['{}.{}'.format(joint.name, channel) for channel in 'xyz'])
-        pos = joint.world_transforms[:, :3, 3]
-        data_list.append(pos)
-        
-        if end_sites:
-            end = list(joint.filter('End'))
-            if end:
-                get_world_positions(end[0])  # There can be only one End Site per joint.
-        for child in joint.filter('JOINT'):
-            get_world_positions(child)
     
-    get_world_positions(root)
-    data = np.concatenate(data_list, axis=1)
+    # Forward kinematics, one hierarchy level at a time. Parents are always done before their children.
+    # world rotation = parent rotation * local rotation, world position = parent rotation * offset + parent position.
+    for depth in range(1, depths.max(initial=0) + 1):
+        level = np.flatnonzero(depths == depth)
+        parent_rotations = rotations[parent_ids[level]]
+        positions[level] = np.matmul(parent_rotations, positions[level, ..., None])[..., 0] + positions[parent_ids[level]]
+        has_rotation = ~is_end[level]
+        rotations[level[has_rotation]] = np.matmul(parent_rotations[has_rotation], rotations[level[has_rotation]])
+    
+    data = np.empty((bvh_tree.nframes, 1 + 3 * n_joints))
+    if time_col is None:
+        time_col = get_time_column(bvh_tree)
+    data[:, 0] = time_col.ravel()
+    # Copy straight into a (frames x joints x 3) view of the buffer, without a reshaped temporary copy.
+    # Scale all world positions in the same pass. Scaling each level would scale the parents' positions again.
+    np.multiply(positions.transpose(1, 0, 2), scale, out=data[:, 1:].reshape(bvh_tree.nframes, n_joints, 3))
     try:
-        np.savetxt(filepath, data, header=','.join(header), fmt='%10.5f', delimiter=',', comments='')
+        _write_csv(filepath, data, header)
         return True
     except IOError as e:
         print("ERROR({}): Could not write to file {}.\n"
@@ -141,25 +195,18 @@ def write_joint_hierarchy(bvh_tree, filepath, scale=1.0):
     :return: If the write process was successful or not.
     :rtype: bool
     """
-    data = list()
+    rows = list()
     for joint in bvh_tree.get_joints(end_sites=True):
-        joint_name = joint.name
-        parent_name = bvh_tree.joint_parent(joint_name).name if bvh_tree.joint_parent(joint_name) else ''
-        row = [joint_name, parent_name]
-        row.extend((scale * offset for offset in bvh_tree.joint_offset(joint.name)))
-        data.append(tuple(row))
-    data = np.array(data, dtype=[('joint', np.unicode_, 20),
-                                 ('parent', np.unicode_, 20),
-                                 ('offset.x', np.float),
-                                 ('offset.y', np.float),
-                                 ('offset.z', np.float)])
+        # Use the nodes directly instead of looking each joint up by name again.
+        parent_name = joint.parent.name if joint.parent is not bvh_tree.root else ''
+        row = [joint.name, parent_name]
+        row.extend(('{:10.5f}'.format(scale * float(offset)) for offset in joint['OFFSET']))
+        rows.append(row)
     try:
-        np.savetxt(filepath,
-                   data,
-                   header=','.join(data.dtype.names),
-                   fmt=['%s', '%s', '%10.5f', '%10.5f', '%10.5f'],
-                   delimiter=',',
-                   comments='')
+        with open(filepath, 'w', newline='') as file_handle:
+            writer = csv.writer(file_handle, lineterminator='\n')
+            writer.writerow(['joint', 'parent', 'offset.x', 'offset.y', 'offset.z'])
+            writer.writerows(rows)
         return True
     except IOError as e:
         print("ERROR({}): Could not write to file {}.\n"
@@ -213,10 +260,11 @@ def bvh2csv(bvh_path,
         if not os.path.exists(dst_dirpath):
             os.mkdir(dst_dirpath)
         dst_filepath = os.path.join(dst_dirpath, os.path.basename(bvh_path)[:-4])
+    time_col = get_time_column(mocap)
     if export_position:
-        pos_success = write_joint_positions(mocap, dst_filepath + '_pos.csv', scale, end_sites)
+        pos_success = write_joint_positions(mocap, dst_filepath + '_pos.csv', scale, end_sites, time_col)
     if export_rotation:
-        rot_success = write_joint_rotations(mocap, dst_filepath + '_rot.csv')
+        rot_success = write_joint_rotations(mocap, dst_filepath + '_rot.csv', time_col)
     if export_hierarchy:
         hierarchy_success = write_joint_hierarchy(mocap, dst_filepath + '_hierarchy.csv', scale)
 
@@ -243,6 +291,7 @@ def main(argv=sys.argv[1:]):
     parser.add_argument("-e", "--ends", action='store_true', help="Include BVH End Sites in position CSV. "
                                                                   "They do not have rotations.")
     parser.add_argument("-H", "--hierarchy", action='store_true', help="Output skeleton hierarchy to CSV file.")
+    add_jobs_argument(parser)
     parser.add_argument("input.bvh", type=str, help="BVH file path or folder for converting to CSV.")
     args = vars(parser.parse_args(argv))
     src_path = args['input.bvh']
@@ -256,6 +305,7 @@ def main(argv=sys.argv[1:]):
         do_rotation = True
         do_position = True
     do_end_sites = args['ends']
+    n_jobs = args['jobs']
     
     files = get_bvh_files(src_path)
     success = bvh2csv(files,
@@ -264,7 +314,8 @@ def main(argv=sys.argv[1:]):
                       export_rotation=do_rotation,
                       export_position=do_position,
                       export_hierarchy=do_hierarchy,
-                      end_sites=do_end_sites)
+                      end_sites=do_end_sites,
+                      n_jobs=n_jobs)
     if not success:
         print("Some errors occurred.")
     return success
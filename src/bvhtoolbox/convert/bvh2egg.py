@@ -170,8 +170,8 @@ import numpy as np
 
 from .. import get_pkg_version
 from .. import BvhTree
-from .. import get_euler_angles, get_affines, prune
-from .multiprocess import get_bvh_files, parallelize
+from .. import get_euler_angles, get_affines, prune, mat2euler_batch
+from .multiprocess import get_bvh_files, parallelize, add_jobs_argument
 
 
 def get_joint_data(bvh_tree, joint, scale=1.0):
@@ -242,18 +242,17 @@ def get_joint_data(bvh_tree, joint, scale=1.0):
         prune(rotation_offset_aff)
         # Conjugation of affine matrices.
         rotated_affines = np.matmul(rotation_offset_aff, affines)
-        # Extract translations and rotations.
+        # Extract translations and rotations for all frames at once.
+        # The affines have no zooms or shears, so there's no need to decompose them.
         axes = axes[::-1]
-        loc_rot = np.array([np.hstack((t, np.degrees(t3d.euler.mat2euler(r, axes='s' + axes)))) for t, r, _, _
-                            in map(t3d.affines.decompose44, rotated_affines)])
-        eulers = loc_rot[:, 3:]
+        eulers = np.degrees(mat2euler_batch(rotated_affines, axes='s' + axes))
 
         rotations = {'p': eulers[:, axes.index('x')],
                      'r': eulers[:, axes.index('y')],
                      'h': eulers[:, axes.index('z')],
                      }
         
-        translations = loc_rot[:, :3] * scale
+        translations = rotated_affines[:, :3, 3] * scale
         data['x'] = translations[:, 0]
         data['y'] = translations[:, 1]
         data['z'] = translations[:, 2]
@@ -271,9 +270,9 @@ def get_joint_data(bvh_tree, joint, scale=1.0):
         data['z'] = [offsets[2]]
         
     for channel, values in rotations.items():
-        unique = np.unique(values)
-        if len(unique) == 1:
-            data[channel] = unique
+        # A constant channel only needs a single value. Comparing is cheaper than sorting for np.unique.
+        if len(values) and (values == values[0]).all():
+            data[channel] = values[:1]
         else:
             data[channel] = values
 
@@ -286,26 +285,37 @@ def get_joint_data(bvh_tree, joint, scale=1.0):
 def data2egg(data):
     # How much indentation?
     level = data['level'] + 3  # There are 3 other open tables before the animation tables start.
+    indent = '  ' * level
     
     def anim_table(component):
-        table_string = '{0}    <S$Anim> {1} {{ <V> {{ {2} }} }}\n'.format('  ' * level,
+        table_string = '{0}    <S$Anim> {1} {{ <V> {{ {2} }} }}\n'.format(indent,
                                                                           component,
                                                                           ' '.join(map(str, data[component])))
         return table_string
-        
-    egg_str  = '{0}<Table> {1} {{\n'.format('  ' * level, data['name'])
-    egg_str += '{0}  <Xfm$Anim_S$> xform {{\n'.format('  ' * level)
-    egg_str += '{0}    <Char*> order {{ {1} }}\n'.format('  ' * level, data['order'])
-    egg_str += '{0}    <Scalar> fps {{ {1} }}\n'.format('  ' * level, data['fps'])
-    for comp in 'ijkprhxyz':
-        if comp in data.keys():
-            egg_str += anim_table(comp)
     
-    egg_str += '{0}  }}\n'.format('  ' * level)
+    lines = ['{0}<Table> {1} {{\n'.format(indent, data['name']),
+             '{0}  <Xfm$Anim_S$> xform {{\n'.format(indent),
+             '{0}    <Char*> order {{ {1} }}\n'.format(indent, data['order']),
+             '{0}    <Scalar> fps {{ {1} }}\n'.format(indent, data['fps'])]
+    lines.extend(anim_table(comp) for comp in 'ijkprhxyz' if comp in data)
+    lines.append('{0}  }}\n'.format(indent))
     if data['leaf']:
-        egg_str += '{0}}}\n'.format('  ' * level)
+        lines.append('{0}}}\n'.format(indent))
         
-    return egg_str
+    return ''.join(lines)
+
+
+def _get_closing_brackets(open_level, target_level=0):
+    """Return curly brackets to close the open tables down to the target level.
+    
+    :param open_level: Number of open tables.
+    :type open_level: int
+    :param target_level: The level determinates the target indentation/depth.
+    :type target_level: int
+    :return: Closing brackets, one per line.
+    :rtype: str
+    """
+    return ''.join('{0}}}\n'.format('  ' * level) for level in range(open_level - 1, target_level - 1, -1))
 
 
 def close_tables(egg_string, target_level=0):
@@ -320,11 +330,8 @@ def close_tables(egg_string, target_level=0):
     :rtype: str
     """
     # Get the last level by counting the spaces to the second to last line break.
-    last_level = egg_string[egg_string[:-1].rfind("\n"):].count("  ")
-    diff = last_level - target_level
-    for level in range(diff):
-        egg_string += '{0}}}\n'.format('  ' * (last_level - level - 1))
-    return egg_string
+    last_level = egg_string[egg_string.rfind("\n", 0, len(egg_string) - 1):].count("  ")
+    return egg_string + _get_closing_brackets(last_level, target_level)
 
 
 def get_egg_anim_tables(bvh_tree, scale=1.0):
@@ -337,13 +344,19 @@ def get_egg_anim_tables(bvh_tree, scale=1.0):
     :return: string containing the animation tables.
     :rtype: str
     """
-    egg_string = ''
+    # Collect the tables and join them once, instead of growing the string with each joint.
+    tables = list()
+    # There are 3 other open tables before the animation tables start.
+    open_level = 3
     for joint in bvh_tree.get_joints(end_sites=True):
         joint_data = get_joint_data(bvh_tree, joint, scale=scale)
+        level = joint_data['level'] + 3
         # Close open tables, before we start a new one with a lesser level.
-        egg_string = close_tables(egg_string, joint_data['level'] + 3)
-        egg_string += data2egg(joint_data)
-    return egg_string
+        tables.append(_get_closing_brackets(open_level, level))
+        tables.append(data2egg(joint_data))
+        # Leaf tables are closed by data2egg, other tables stay open for their children.
+        open_level = level if joint_data['leaf'] else level + 1
+    return ''.join(tables)
 
 
 @parallelize
@@ -368,7 +381,7 @@ def bvh2egg(bvh_path, dst_path=None, scale=1.0):
     comment = '<Comment> {{ Converted from {0} }}\n'.format(os.path.basename(bvh_path))
     init_table_str = '<Table> {\n  <Bundle> Armature {\n    <Table> "<skeleton>" {\n'
     
-    egg_str = coords_up + comment + init_table_str + get_egg_anim_tables(mocap, scale=scale)
+    egg_str = ''.join([coords_up, comment, init_table_str, get_egg_anim_tables(mocap, scale=scale)])
     egg_str = close_tables(egg_str)
     
     if not dst_path:
@@ -398,14 +411,16 @@ def main(argv=sys.argv[1:]):
     parser.add_argument("-s", "--scale", type=float, default=1.0,
                         help="Scale factor for root translation and offset values.\n"
                              "In case you have to switch from centimeters to meters or vice versa.")
+    add_jobs_argument(parser)
     parser.add_argument("input.bvh", type=str, help="BVH source file or folder path to convert to egg.")
     args = vars(parser.parse_args(argv))
     src_path = args['input.bvh']
     dst_path = args['out']
     scale = args['scale']
+    n_jobs = args['jobs']
     
     files = get_bvh_files(src_path)
-    success = bvh2egg(files, dst_path=dst_path, scale=scale)
+    success = bvh2egg(files, dst_path=dst_path, scale=scale, n_jobs=n_jobs)
     return success
 
 
@@ -75,7 +75,6 @@ import os
 import sys
 import argparse
 import xml.etree.ElementTree as XmlTree
-import itertools
 from multiprocessing import freeze_support
 
 import numpy as np
@@ -83,13 +82,28 @@ import transforms3d as t3d
 
 from .. import get_pkg_version
 from .. import BvhTree
-from .. import get_quaternions, get_translations
-from .prettify_elementtree import prettify
-from .multiprocess import get_bvh_files, parallelize
+from .. import get_quaternions, get_all_quaternions, get_translations, qmult_batch
+from .multiprocess import get_bvh_files, parallelize, add_jobs_argument
 
 
-def get_track(bvh_tree, joint_name, scale=1.0):
-    """Build the XML structure for a joints animation data.
+def _format_rows(values):
+    """Format each row of a 2D array as a string of space separated values.
+    
+    :param values: Values to format (rows x columns).
+    :type values: numpy.ndarray
+    :return: One string per row.
+    :rtype: list
+    """
+    n_rows, n_cols = values.shape
+    if not n_rows:
+        return []
+    # A single formatting operation for all values is much faster than numpy's array2string for each row.
+    row_format = ' '.join(['%.8g'] * n_cols)
+    return ('\n'.join([row_format] * n_rows) % tuple(values.ravel().tolist())).split('\n')
+
+
+def _get_keyframe_values(bvh_tree, joint_name, scale=1.0, quats=None):
+    """Compute the translation and rotation of a joint in each frame as strings for the XAF file.
     
     :param bvh_tree: BVH tree that holds the data.
     :type bvh_tree: BvhTree
@@ -97,72 +111,130 @@ def get_track(bvh_tree, joint_name, scale=1.0):
     :type joint_name: str
     :param scale: Scale factor for root translation and offset values.
     :type scale: float
-    :return: XML structure with animation data for this joint.
-    :rtype: xml.etree.ElementTree.Element
+    :param quats: Precomputed wxyz quaternions of the joint in 'rzxy' order (frames x 4). Computed if not given.
+    :type quats: numpy.ndarray
+    :return: Translation strings and rotation strings, one per frame.
+    :rtype: tuple
     """
-    n_frames = bvh_tree.nframes
-    # Find correct BoneID (when End Sites are included).
-    track = XmlTree.Element("TRACK", {'BONEID': str(bvh_tree.get_joint_index(joint_name)),
-                                      'NUMKEYFRAMES': str(n_frames)
-                                      })
-    
     # Transform into left handed coordinate system with Y still as up-axis.
     """
     # Wiki: Like rotation matrices, quaternions must sometimes be renormalized due to rounding errors,
     # to make sure that they correspond to valid rotations. The computational cost of renormalizing a
     # quaternion, however, is much less than for normalizing a 3 × 3 matrix.
     """
-    quats = get_quaternions(bvh_tree, joint_name, axes='rzxy')
+    if quats is None:
+        quats = get_quaternions(bvh_tree, joint_name, axes='rzxy')
     if not bvh_tree.joint_parent(joint_name):
         is_root = True
         # The root in the skeleton definition gets rotated by -90 degrees around X. Do the same here.
         quat_offset = t3d.euler.euler2quat(*np.radians([-90, 0, 0]), axes='sxyz')
-        quats = np.array(list(map(t3d.quaternions.qmult, quats, itertools.repeat(quat_offset))))
-        # For whatever reason switch w and x.
-        quats[:, 0], quats[:, 1] = quats[:, 1], quats[:, 0].copy()
-        # Root translation.
-        translations = get_translations(bvh_tree, joint_name) * scale
-        # Invert Z direction.
-        translations[:, 2] *= -1
-        # Because of the rotation, we need to switch Y and Z translation.
-        translations[:, 1], translations[:, 2] = translations[:, 2], translations[:, 1].copy()
+        # Multiply all frames at once.
+        quats = qmult_batch(quats, quat_offset)
+        # For whatever reason switch w and x, then reorder to x, y, z, w as Cal3D needs it. Both in one step.
+        quats = quats[:, [0, 2, 3, 1]]
+        # Root translation. Because of the rotation, we need to switch Y and Z translation.
+        translations = get_translations(bvh_tree, joint_name)[:, [0, 2, 1]]
+        # Scale and invert Z direction.
+        translations *= [scale, -scale, scale]
     else:
         is_root = False
-        # Invert the xyz-vector.
-        quats[:, 1:] *= -1
-    # Cal3D needs the quaternions in x, y, z, w.
-    quats = np.roll(quats, shift=-1, axis=1)
+        # Invert the xyz-vector. Cal3D needs the quaternions in x, y, z, w.
+        xyzw = np.empty_like(quats)
+        np.negative(quats[:, 1:], out=xyzw[:, :3])
+        xyzw[:, 3] = quats[:, 0]
+        quats = xyzw
     
     offsets = bvh_tree.joint_offset(joint_name)
     offsets_str = '{} {} {}'.format(offsets[0]*scale, offsets[1]*scale, offsets[2]*scale)
-    # For non-root joints use offset.
-    t_str = offsets_str
+    # Convert all values to strings for xml at once instead of formatting them frame by frame.
+    if is_root:
+        t_strs = _format_rows(translations)
+    else:
+        # For non-root joints use offset.
+        t_strs = [offsets_str] * bvh_tree.nframes
+    r_strs = _format_rows(quats)
+    return t_strs, r_strs
+
+
+def get_track(bvh_tree, joint_name, scale=1.0, quats=None):
+    """Build the XML structure for a joints animation data.
     
-    def get_keyframe(frame):
-        nonlocal t_str
+    :param bvh_tree: BVH tree that holds the data.
+    :type bvh_tree: BvhTree
+    :param joint_name: Name of joint to extract data from.
+    :type joint_name: str
+    :param scale: Scale factor for root translation and offset values.
+    :type scale: float
+    :param quats: Precomputed wxyz quaternions of the joint in 'rzxy' order (frames x 4). Computed if not given.
+    :type quats: numpy.ndarray
+    :return: XML structure with animation data for this joint.
+    :rtype: xml.etree.ElementTree.Element
+    """
+    n_frames = bvh_tree.nframes
+    # Find correct BoneID (when End Sites are included).
+    track = XmlTree.Element("TRACK", {'BONEID': str(bvh_tree.get_joint_index(joint_name)),
+                                      'NUMKEYFRAMES': str(n_frames)
+                                      })
+    t_strs, r_strs = _get_keyframe_values(bvh_tree, joint_name, scale, quats)
+    
+    def get_keyframe(frame, t_str, r_str):
         time = frame * bvh_tree.frame_time
         keyframe = XmlTree.Element("KEYFRAME", {'TIME': str(time)})
-    
-        # Only root should have translation.
-        if is_root:
-            t = translations[frame]
-            # Convert to string for xml. Exclude square brackets at beginning and end. Slicing way faster than re.sub.
-            t_str = str(t)[1:-1]
-        
-        r = quats[frame]
-        # Convert to string for xml. Exclude square brackets.
-        r_str = np.array2string(r, precision=8, floatmode='maxprec', suppress_small=True)[1:-1]
-        
         XmlTree.SubElement(keyframe, "TRANSLATION").text = t_str
         XmlTree.SubElement(keyframe, "ROTATION").text = r_str
         return keyframe
     
-    keyframes = list(map(get_keyframe, list(range(n_frames))))
+    keyframes = list(map(get_keyframe, range(n_frames), t_strs, r_strs))
     track.extend(keyframes)
     
     return track
 
 
+_KEYFRAME_TEMPLATE = ('    <KEYFRAME TIME="{}">\n'
+                      '      <TRANSLATION>{}</TRANSLATION>\n'
+                      '      <ROTATION>{}</ROTATION>\n'
+                      '    </KEYFRAME>\n')
+
+
+def _get_keyframe_times(bvh_tree):
+    """
+    :param bvh_tree: BVH tree that holds the data.
+    :type bvh_tree: BvhTree
+    :return: Time of each frame as string.
+    :rtype: list
+    """
+    return [str(frame * bvh_tree.frame_time) for frame in range(bvh_tree.nframes)]
+
+
+def _get_track_string(bvh_tree, joint_name, scale=1.0, quats=None, times=None):
+    """Format a joints animation data as an indented TRACK element, the same as get_track after pretty printing.
+    
+    :param bvh_tree: BVH tree that holds the data.
+    :type bvh_tree: BvhTree
+    :param joint_name: Name of joint to extract data from.
+    :type joint_name: str
+    :param scale: Scale factor for root translation and offset values.
+    :type scale: float
+    :param quats: Precomputed wxyz quaternions of the joint in 'rzxy' order (frames x 4). Computed if not given.
+    :type quats: numpy.ndarray
+    :param times: Precomputed time of each frame as string. Computed if not given.
+    :type times: list
+    :return: TRACK element with keyframes as XML string.
+    :rtype: str
+    """
+    n_frames = bvh_tree.nframes
+    track_tag = 'TRACK BONEID="{}" NUMKEYFRAMES="{}"'.format(bvh_tree.get_joint_index(joint_name), n_frames)
+    if not n_frames:
+        return '  <{}/>\n'.format(track_tag)
+    if times is None:
+        times = _get_keyframe_times(bvh_tree)
+    t_strs, r_strs = _get_keyframe_values(bvh_tree, joint_name, scale, quats)
+    parts = ['  <{}>\n'.format(track_tag)]
+    parts.extend(_KEYFRAME_TEMPLATE.format(time, t_str, r_str) for time, t_str, r_str in zip(times, t_strs, r_strs))
+    parts.append('  </TRACK>\n')
+    return ''.join(parts)
+
+
 @parallelize
 def bvh2xaf(bvh_path, dst_path=None, scale=1.0):
     """ Converts a BVH file into the Cal3D XAF animation file format.
@@ -184,29 +256,25 @@ def bvh2xaf(bvh_path, dst_path=None, scale=1.0):
     joint_names = mocap.get_joints_names()
     n_tracks = len(joint_names)
     
-    xml_root = XmlTree.Element("ANIMATION")
-    xml_root.set('VERSION', '1100')
-    xml_root.set('MAGIC', 'XAF')
-    xml_root.set('DURATION', str(duration))
-    xml_root.set('NUMTRACKS', str(n_tracks))
-    comment = XmlTree.Comment('Converted from {}'.format(os.path.basename(bvh_path)))
-    xml_root.append(comment)
-    # Use map to compute tracks.
-    tracks = list(map(get_track, itertools.repeat(mocap), joint_names, itertools.repeat(scale)))
-    # Extend tracks to xml_root as children.
-    xml_root.extend(tracks)
-    # Add indentation.
-    xml_str = prettify(xml_root)
-    
     if not dst_path:
         dst_path = bvh_path[:-3] + 'xaf'
         
     if os.path.isdir(dst_path):
         dst_path = os.path.join(dst_path, os.path.basename(bvh_path)[:-3] + 'xaf')
-        
+    
+    # Convert the rotations of all joints in one batch.
+    all_quats = get_all_quaternions(mocap, joint_names, axes='rzxy')
+    # All tracks share the same keyframe times.
+    times = _get_keyframe_times(mocap)
     try:
         with open(dst_path, 'w') as file_handle:
-            file_handle.write(xml_str)
+            # The file is written track by track instead of building and pretty printing the whole XML tree.
+            file_handle.write('<?xml version="1.0" ?>\n'
+                              '<ANIMATION VERSION="1100" MAGIC="XAF" DURATION="{}" NUMTRACKS="{}">\n'
+                              '  <!--Converted from {}-->\n'.format(duration, n_tracks, os.path.basename(bvh_path)))
+            for joint_name, quats in zip(joint_names, all_quats):
+                file_handle.write(_get_track_string(mocap, joint_name, scale, quats, times))
+            file_handle.write('</ANIMATION>\n')
         return True
     except IOError as e:
         print("ERROR({}): Could not write to file {}.\n"
@@ -225,14 +293,16 @@ def main(argv=sys.argv[1:]):
     parser.add_argument("-s", "--scale", type=float, default=1.0,
                         help="Scale factor for root translation and offset values.\n"
                              "In case you have to switch from centimeters to meters or vice versa.")
+    add_jobs_argument(parser)
     parser.add_argument("input.bvh", type=str, help="BVH source file or folder path to convert to XAF.")
     args = vars(parser.parse_args(argv))
     src_path = args['input.bvh']
     dst_path = args['out']
     scale = args['scale']
+    n_jobs = args['jobs']
     
     files = get_bvh_files(src_path)
-    success = bvh2xaf(files, dst_path=dst_path, scale=scale)
+    success = bvh2xaf(files, dst_path=dst_path, scale=scale, n_jobs=n_jobs)
     return success
 
 
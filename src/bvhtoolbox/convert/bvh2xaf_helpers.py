@@ -23,11 +23,9 @@
 """
 This collection of function is for debugging purposes.
 The functions are meant to be used in an interactive session to evaluate conversion results.
-Requires 'dev' extras when installing bvhtoolbox.
 """
 import numpy as np
 import transforms3d as t3d
-from sympy import Matrix
 
 from .. import BvhTree
 
@@ -41,6 +39,10 @@ _AXES2TUPLE = {
     'yxz': (1, 1), 'yxy': (1, 1), 'zxy': (2, 0),
     'zxz': (2, 0), 'zyx': (2, 1), 'zyz': (2, 1)}
 
+# Indices for converting 'xyz' order to each axes order, computed once.
+_AXES2INDICES = {axes: [firstaxis, _NEXT_AXIS[firstaxis + parity], _NEXT_AXIS[firstaxis - parity + 1]]
+                 for axes, (firstaxis, parity) in _AXES2TUPLE.items()}
+
 
 def reorder_axes(xyz, axes='xyz'):
     """Takes an input array in xyz order and re-arranges it to given axes order.
@@ -50,11 +52,7 @@ def reorder_axes(xyz, axes='xyz'):
     :return: array in axes order.
     :rtype: numpy.ndarray
     """
-    firstaxis, parity = _AXES2TUPLE[axes]
-    i = firstaxis
-    j = _NEXT_AXIS[i + parity]
-    k = _NEXT_AXIS[i - parity + 1]
-    return np.array([xyz[i], xyz[j], xyz[k]])
+    return np.asarray(xyz)[_AXES2INDICES[axes]]
     
     
 def prune(a, epsilon=0.00000001):
@@ -208,7 +206,7 @@ def euler_str2quat(euler_string, in_order='zxy', conversion_order='rzxz'):
     :rtype: numpy.ndarray
     """
     eulers_deg = np.fromstring(euler_string, sep=' ')
-    eulers_xyz = np.array([eulers_deg[in_order.lower().index(i)] for i in 'xyz'])
+    eulers_xyz = eulers_deg[[in_order.lower().index(i) for i in 'xyz']]
     ordered_euler = reorder_axes(eulers_xyz, axes=conversion_order[1:])
     eulers_rad = np.radians(ordered_euler)
     quat = t3d.euler.euler2quat(*eulers_rad, axes=conversion_order)
@@ -296,7 +294,8 @@ def joint2affine(bvh_tree, joint_name, frame=0, axes='rzxz'):
     
     
 def get_transform_matrix(a, b):
-    """Get transformation matrix p for converting a to b, such that B = P**-1 * A * P. Matrices A and B are similar.
+    """Get transformation matrix p for converting a to b, such that B = P**-1 * A * P.
+    Matrices A and B are similar and diagonalizable.
     F = G**-1 * A * G
     F = H**1 * B * H
     P = G * H**-1
@@ -304,7 +303,11 @@ def get_transform_matrix(a, b):
     :param b: Matrix B
     :return: P
     """
-    g, _ = Matrix(a).jordan_form()
-    h, _ = Matrix(b).jordan_form()
-    p = g * h.inv()
-    return np.array(p)
+    # For diagonalizable matrices the eigenvectors take the place of the Jordan basis.
+    w_a, g = np.linalg.eig(a)
+    w_b, h = np.linalg.eig(b)
+    # Both need the same order of eigenvalues.
+    g = g[:, np.lexsort((w_a.imag, w_a.real))]
+    h = h[:, np.lexsort((w_b.imag, w_b.real))]
+    p = np.matmul(g, np.linalg.inv(h))
+    return np.real_if_close(p)
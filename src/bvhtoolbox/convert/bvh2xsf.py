@@ -55,6 +55,7 @@ import argparse
 import sys
 import xml.etree.ElementTree as XmlTree
 import itertools
+from multiprocessing import freeze_support
 
 import numpy as np
 import transforms3d as t3d
@@ -62,9 +63,37 @@ import transforms3d as t3d
 from .. import get_pkg_version
 from .. import BvhTree
 from .prettify_elementtree import prettify
+from .multiprocess import get_bvh_files, parallelize, add_jobs_argument
 
+# Rotations are the same for every file, so they are converted to quaternion (x, y, z, w) strings only once.
+# The root is rotated by -90 degrees around the X-Axis.
+_ROOT_ROT_STR = np.array_str(np.roll(t3d.euler.euler2quat(*np.radians([-90., 0., 0.])), -1))[1:-1]
+# All joints get rotated by 90 degrees.
+_LOC_ROT_STR = str(np.roll(t3d.euler.euler2quat(*np.radians([90., -0., 0.])), -1))[1:-1]
 
-def get_bone_xml(bvh_tree, joint_name, scale=1.0):
+
+def _get_world_translations(bvh_tree, scale=1.0):
+    """Compute the world position of all joints in the rest pose.
+    There are no rotations in the rest pose, so offsets simply add up along the hierarchy.
+    
+    :param bvh_tree: BVH tree that holds the data.
+    :type bvh_tree: BvhTree
+    :param scale: Scale factor for offset values.
+    :type scale: float
+    :return: World position of each joint and End Site by name.
+    :rtype: dict
+    """
+    world_translations = dict()
+    # Joints are in depth-first order, so each parent's position is known before its children's.
+    for joint in bvh_tree.get_joints(end_sites=True):
+        offsets = np.array(joint['OFFSET'], dtype=float) * scale
+        if joint.parent is not bvh_tree.root:
+            offsets += world_translations[joint.parent.name]
+        world_translations[joint.name] = offsets
+    return world_translations
+
+
+def get_bone_xml(bvh_tree, joint_name, scale=1.0, world_translations=None):
     """Build the XML structure for a joints topological data.
     
     :param bvh_tree: BVH tree that holds the data.
@@ -73,6 +102,8 @@ def get_bone_xml(bvh_tree, joint_name, scale=1.0):
     :type joint_name: str
     :param scale: Scale factor for root translation and offset values.
     :type scale: float
+    :param world_translations: Precomputed world position of each joint by name. Computed if not given.
+    :type world_translations: dict
     :return: XML structure with topological data for this joint.
     :rtype: xml.etree.ElementTree.Element
     """
@@ -85,31 +116,23 @@ def get_bone_xml(bvh_tree, joint_name, scale=1.0):
                                         })
     
     offsets = [float(o) * scale for o in bvh_tree.joint_offset(joint_name)]  # Convert to meters.
-    world_trans = t3d.affines.compose(offsets, np.identity(3), np.ones(3))
     parent_id = bvh_tree.joint_parent_index(joint_name)
     if parent_id:
         rot_str = "0 0 0 1"  # Quaternion (x, y, z, w)
     else:
-        rot_str = np.array_str(np.roll(t3d.euler.euler2quat(*np.radians([-90., 0., 0.])), -1))[1:-1]
+        rot_str = _ROOT_ROT_STR
         offsets[1:] = offsets[-1:-3:-1]  # Switch Y and Z because the root is rotated around the X-Axis by -90 degrees.
     offsets_str = '{} {} {}'.format(offsets[0], offsets[1], offsets[2])
-    # All joints get rotated by 90 degrees.
-    loc_rot = np.roll(t3d.euler.euler2quat(*np.radians([90., -0., 0.])), -1)
-    loc_rot_str = str(loc_rot)[1:-1]
     
-    # Construct world position of joint.
-    parent = bvh_tree.joint_parent(joint_name)
-    while parent:
-        parent_offsets = [float(o) * scale for o in bvh_tree.joint_offset(parent.name)]
-        parent_trans = t3d.affines.compose(parent_offsets, np.identity(3), np.ones(3))
-        world_trans = np.matmul(world_trans, parent_trans)
-        parent = bvh_tree.joint_parent(parent.name)
-    t_world = world_trans[:3, -1]
+    # World position of joint.
+    if world_translations is None:
+        world_translations = _get_world_translations(bvh_tree, scale)
+    t_world = world_translations[joint_name]
     
     XmlTree.SubElement(bone_xml, "TRANSLATION").text = offsets_str
     XmlTree.SubElement(bone_xml, "ROTATION").text = rot_str
     XmlTree.SubElement(bone_xml, "LOCALTRANSLATION").text = str(-t_world)[1:-1]
-    XmlTree.SubElement(bone_xml, "LOCALROTATION").text = loc_rot_str
+    XmlTree.SubElement(bone_xml, "LOCALROTATION").text = _LOC_ROT_STR
     XmlTree.SubElement(bone_xml, "PARENTID").text = str(parent_id)
     
     for child in children:
@@ -118,15 +141,18 @@ def get_bone_xml(bvh_tree, joint_name, scale=1.0):
     return bone_xml
     
     
+@parallelize
 def bvh2xsf(bvh_filepath, dst_filepath=None, scale=1.0):
     """Converts a BVH file into the Cal3D XSF skeleton file format.
 
-    :param bvh_filepath: File path for BVH source.
-    :type bvh_filepath: str
-    :param dst_filepath: File path for destination Cal3D skeleton file (XSF).
+    :param bvh_filepath: File path(s) for BVH source.
+    :type bvh_filepath: str|list
+    :param dst_filepath: File or folder path for destination Cal3D skeleton file (XSF).
     :type dst_filepath: str
     :param scale: Scale factor for root translation and offset values.
     :type scale: float
+    :return: If the conversion was successful or not.
+    :rtype: bool
     """
     try:
         with open(bvh_filepath) as file_handle:
@@ -144,7 +170,10 @@ def bvh2xsf(bvh_filepath, dst_filepath=None, scale=1.0):
     comment = XmlTree.Comment('Converted from {}'.format(os.path.basename(bvh_filepath)))
     xml_root.append(comment)
     # Use map to compute tracks.
-    bones = list(map(get_bone_xml, itertools.repeat(mocap), joints, itertools.repeat(scale)))
+    # World positions of all joints in one pass.
+    world_translations = _get_world_translations(mocap, scale)
+    bones = list(map(get_bone_xml, itertools.repeat(mocap), joints, itertools.repeat(scale),
+                     itertools.repeat(world_translations)))
     # Extend tracks to xml_root as children.
     xml_root.extend(bones)
     # Add indentation.
@@ -152,6 +181,9 @@ def bvh2xsf(bvh_filepath, dst_filepath=None, scale=1.0):
 
     if not dst_filepath:
         dst_filepath = bvh_filepath[:-3] + 'xsf'
+    
+    if os.path.isdir(dst_filepath):
+        dst_filepath = os.path.join(dst_filepath, os.path.basename(bvh_filepath)[:-3] + 'xsf')
     try:
         with open(dst_filepath, 'w') as file_handle:
             file_handle.write(xml_str)
@@ -168,21 +200,25 @@ def main(argv=sys.argv[1:]):
         description="""Convert BVH file to Cal3D ASCII skeleton file (XSF).""",
         formatter_class=argparse.RawTextHelpFormatter)
     parser.add_argument("-v", "--ver", action='version', version='%(prog)s v{}'.format(get_pkg_version()))
-    parser.add_argument("-o", "--out", type=str, help="Destination file path for XSF file.\n"
+    parser.add_argument("-o", "--out", type=str, help="Destination file or folder path for XSF file.\n"
                                                       "If no out path is given, BVH file path is used.")
     parser.add_argument("-s", "--scale", type=float, default=1.0,
                         help="Scale factor for root translation and offset values.\n"
                              "In case you have to switch from centimeters to meters or vice versa.")
-    parser.add_argument("input.bvh", type=str, help="BVH source file to convert to XSF.")
+    add_jobs_argument(parser)
+    parser.add_argument("input.bvh", type=str, help="BVH source file or folder path to convert to XSF.")
     args = vars(parser.parse_args(argv))
-    src_file_path = args['input.bvh']
-    dst_file_path = args['out']
+    src_path = args['input.bvh']
+    dst_path = args['out']
     scale = args['scale']
+    n_jobs = args['jobs']
     
-    success = bvh2xsf(src_file_path, dst_file_path, scale)
+    files = get_bvh_files(src_path)
+    success = bvh2xsf(files, dst_filepath=dst_path, scale=scale, n_jobs=n_jobs)
     return success
     
     
 if __name__ == "__main__":
+    freeze_support()
     exit_code = int(not main())
     sys.exit(exit_code)
@@ -31,9 +31,12 @@ Ain't nobody got time for that! :D
 """
 
 import os
+import io
+import csv
 import errno
 import sys
 import argparse
+import warnings
 
 import numpy as np
 
@@ -52,14 +55,19 @@ def get_hierarchy_data(hierarchy_file, scale=1.0):
     :rtype: dict
     """
     try:
-        rec_array = np.recfromcsv(hierarchy_file, encoding='UTF-8')
+        with open(hierarchy_file, newline='', encoding='utf-8') as file_handle:
+            reader = csv.DictReader(file_handle)
+            # Column names are case-insensitive.
+            reader.fieldnames = [name.strip().lower() for name in reader.fieldnames]
+            joint_info = {row['joint']: {'parent': row['parent'],
+                                         'offset': np.array([float(row['offset.x']),
+                                                             float(row['offset.y']),
+                                                             float(row['offset.z'])]) * scale,
+                                         'children': []}
+                          for row in reader}
     except OSError as e:
         print("ERROR:", e)
         raise
-    offsets = np.array(rec_array[['offsetx', 'offsety', 'offsetz']].tolist())
-    offsets *= scale
-    joint_info = {j[0]: {'parent': j[1], 'offset': offsets[i], 'children': []}
-                  for i, j in enumerate(rec_array)}
     _update_children(joint_info)
     input_is_sane = hierarchy_sanity_check(joint_info)
     return joint_info
@@ -79,9 +87,7 @@ def _update_children(nodes):
             if not parent:  # Root has no parent.
                 continue
             raise ValueError("ERROR: Parent of {} cannot be found in the hierarchy definition!".format(node))
-        p_children = p_props['children']
-        p_children.append(node)
-        p_props.update({'children': p_children})
+        p_props['children'].append(node)
         
         
 def _update_channels(nodes, root_pos_channels, rot_channels):
@@ -123,7 +129,7 @@ def hierarchy_sanity_check(nodes):
             raise ValueError("ERROR: Joint {} cannot be parent of itself!".format(node))
         if parent in properties['children']:
             raise ValueError("Impossible cyclic relation detected for joints {} and {}!".format(node, parent))
-        if parent and parent not in nodes.keys():
+        if parent and parent not in nodes:
             raise ValueError("ERROR: Parent of joint {} cannot be found in the hierarchy definition!".format(node))
     if not found_root:  # Would probably be caught before.
         raise ValueError("ERROR: No root joint found in the hierarchy definition!")
@@ -155,14 +161,31 @@ def get_transform_data(transforms_file):
     :rtype: tuple
     """
     # Numpy is losing case of column names when using np.recfromcsv().
-    # Read 1st line as header manually instead and use genfromtxt() to get data.
+    # Read 1st line as header manually instead and parse the rest of the file in the same pass.
     try:
-        data = np.genfromtxt(transforms_file, delimiter=",", skip_header=1)
+        with open(transforms_file, encoding='utf-8') as file_handle:
+            columns = file_handle.readline().strip().split(sep=',')
+            text = file_handle.read().strip()
     except OSError as e:
         print("ERROR:", e)
         raise
-    with open(transforms_file, 'rb') as file_handle:
-        columns = file_handle.readline().strip().decode("utf-8").split(sep=',')
+    
+    # Each row must have a field for each column, so values can't be shifted into another row by the bulk parsing.
+    lines = text.split('\n')
+    num_delimiters = len(columns) - 1
+    if any(line.count(',') != num_delimiters for line in lines):
+        # Rows of different length or blank lines. Let genfromtxt deal with those.
+        return columns, np.genfromtxt(io.StringIO(text), delimiter=",")
+    
+    # All values are numbers, so parse them in bulk with line breaks as another delimiter.
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', DeprecationWarning)  # Raised when the text can't be parsed to its end.
+        data = np.fromstring(text.replace('\n', ','), sep=',')
+    if data.size != len(lines) * len(columns):
+        # Missing or malformed values. Let genfromtxt deal with those.
+        data = np.genfromtxt(io.StringIO(text), delimiter=",")
+    else:
+        data = data.reshape(-1, len(columns))
         
     return columns, data
     
@@ -175,7 +198,7 @@ def df_to_joints(df):
     :return: Joint names.
     :rtype: list
     """
-    joints = sorted(set((x.split('.')[0] for x in df if x != 'time')))
+    joints = sorted({x.partition('.')[0] for x in df if x != 'time'})
     return joints
 
 
@@ -187,16 +210,17 @@ def _df_to_channels(df):
     :return: Dictionary with joint names as keys and list of rotation channels as values.
     :rtype: dict
     """
-    # Get a version of df that does not contain 'time'.
-    dof = df.copy()
-    dof.remove('time')
-    joints = df_to_joints(df)
-    joint_channels = dict()
-    try:
-        for joint in joints:
-            joint_channels[joint] = [ch.split('.')[1].upper() + "rotation" for ch in dof if joint == ch.split('.')[0]]
-    except IndexError:
-        raise ValueError("ERROR: degrees of freedom (columns) must be in the form of: joint.axis, e.g. Hips.x")
+    # Group the channels by joint in a single pass over the degrees of freedom, except 'time'.
+    channels = dict()
+    for ch in df:
+        if ch == 'time':
+            continue
+        parts = ch.split('.')
+        if len(parts) < 2:
+            raise ValueError("ERROR: degrees of freedom (columns) must be in the form of: joint.axis, e.g. Hips.x")
+        channels.setdefault(parts[0], list()).append(parts[1].upper() + "rotation")
+    # Keep the alphabetical order of df_to_joints.
+    joint_channels = {joint: channels[joint] for joint in sorted(channels)}
     return joint_channels
     
     
@@ -214,70 +238,70 @@ def _get_frame_time(time_steps):
     return frame_time
 
     
-def _get_joint_depth(nodes, joint):
-    """ How deep in the tree are we?
+def _get_joint_depths(nodes):
+    """ How deep in the tree is each joint? Each depth is computed only once.
     
     :param nodes: Dictionary with skeleton hierarchy.
     :type nodes: dict
-    :param joint: Name of the joint in question.
-    :type joint: str
-    :return: The depth of the joint in the hierarchy.
-    :rtype: int
+    :return: The depth of each joint in the hierarchy. The root has depth 0.
+    :rtype: dict
     """
-    depth = 0
-    parent = nodes[joint]['parent']
-    while parent:
-        depth += 1
-        parent = nodes[parent]['parent']
-    return depth
-
-
-def _get_joint_string(nodes, joint):
+    depths = dict()
+    for joint in nodes:
+        # Walk up until a joint with known depth or the root is reached.
+        path = []
+        node = joint
+        while node and node not in depths:
+            path.append(node)
+            node = nodes[node]['parent']
+        depth = depths[node] if node else -1
+        for node in reversed(path):
+            depth += 1
+            depths[node] = depth
+    return depths
+
+
+def _get_joint_string(nodes, joint, depth):
     """ Compose bvh string representation of a joint in hierarchy with indentation according to its depth.
     
     :param nodes: Dictionary with skeleton hierarchy.
     :type nodes: dict
     :param joint: Name of the joint in question.
     :type joint: str
+    :param depth: The depth of the joint in the hierarchy.
+    :type depth: int
     :return: The joints part of the bvh hierarchy section.
     :rtype: str
     """
-    depth = _get_joint_depth(nodes, joint)
+    indent = '  ' * depth
     properties = nodes[joint]
+    offset = ' '.join(map(str, properties['offset'].tolist()))
     if not properties['parent']:
-        s = '{0}ROOT {1}\n'.format('  ' * depth, str(joint))
+        name = 'ROOT {}'.format(joint)
     elif not properties['children']:
-        s = '{0}{1}\n'.format('  ' * depth, 'End Site')
+        name = 'End Site'
     else:
-        s = '{0}JOINT {1}\n'.format('  ' * depth, str(joint))
-        
-    s += '{0}{{\n'.format('  ' * depth)
-    s += '{0}{1} {2}\n'.format('  ' * (depth + 1), 'OFFSET', ' '.join(properties['offset'].astype(str)))
+        name = 'JOINT {}'.format(joint)
+    
     if not properties['children']:
-        s += '{0}}}\n'.format('  ' * depth)
+        s = '{0}{1}\n{0}{{\n{0}  OFFSET {2}\n{0}}}\n'.format(indent, name, offset)
     else:
-        s += '{0}{1} {2} {3}\n'.format('  ' * (depth + 1), 'CHANNELS',
-                                       len(properties['channels']),
-                                       ' '.join(properties['channels']))
+        s = '{0}{1}\n{0}{{\n{0}  OFFSET {2}\n{0}  CHANNELS {3} {4}\n'.format(indent, name, offset,
+                                                                          len(properties['channels']),
+                                                                          ' '.join(properties['channels']))
     return s
 
 
-def _close_scopes(hierarchy_string, target_depth=0):
-    """ The string is hierarchically ordered. This function appends curly brackets to close open scopes.
-    It takes the indentation of the last closed bracket as reference for the current level/depth of the hierarchy.
-    :param hierarchy_string:
-    :type hierarchy_string: str
+def _close_scopes(open_depth, target_depth=0):
+    """ The hierarchy is written depth-first. This function returns curly brackets to close open scopes.
+    :param open_depth: The depth of the innermost open scope.
+    :type open_depth: int
     :param target_depth: The depth determines the target indentation.
     :type target_depth: int
-    :return: string with closed scopes.
+    :return: string with closing brackets.
     :rtype: str
     """
-    # Get the last level by counting the spaces to the second to last line break.
-    last_depth = hierarchy_string[hierarchy_string[:-1].rfind("\n"):].count("  ")
-    diff = last_depth - target_depth
-    for depth in range(diff):
-        hierarchy_string += '{0}}}\n'.format('  ' * (last_depth - depth - 1))
-    return hierarchy_string
+    return ''.join('{0}}}\n'.format('  ' * depth) for depth in range(open_depth - 1, target_depth - 1, -1))
 
 
 def _get_hierarchy_string(nodes):
@@ -288,12 +312,17 @@ def _get_hierarchy_string(nodes):
     :return: Hierarchy as bvh string representation.
     :rtype: str
     """
-    s = 'HIERARCHY\n'
+    parts = ['HIERARCHY\n']
+    depths = _get_joint_depths(nodes)
+    open_depth = 0
     for joint in nodes:
-        s = _close_scopes(s, _get_joint_depth(nodes, joint))
-        s += _get_joint_string(nodes, joint)
-    s = _close_scopes(s)
-    return s
+        depth = depths[joint]
+        parts.append(_close_scopes(open_depth, depth))
+        parts.append(_get_joint_string(nodes, joint, depth))
+        # An End Site closes its own scope, a joint's scope stays open for its children.
+        open_depth = depth if not nodes[joint]['children'] else depth + 1
+    parts.append(_close_scopes(open_depth))
+    return ''.join(parts)
 
 
 def _get_motion_string(n_frames, frame_time, frames):
@@ -308,13 +337,13 @@ def _get_motion_string(n_frames, frame_time, frames):
     :return: Motion as string representation.
     :rtype: str
     """
-    s = 'MOTION\n'
-    s += 'Frames: {}\n'.format(n_frames)
-    s += 'Frame Time: {}\n'.format(frame_time)
-    for frame in frames.astype(str):
-        s += ' '.join(frame)
-        s += '\n'
-    return s
+    lines = ['MOTION',
+             'Frames: {}'.format(n_frames),
+             'Frame Time: {}'.format(frame_time)]
+    # Convert all values to strings at once and join once instead of growing the string frame by frame.
+    lines.extend(' '.join(frame) for frame in frames.astype(str).tolist())
+    lines.append('')
+    return '\n'.join(lines)
     
 
 def csv2bvh_string(hierarchy_file, position_file, rotation_file, scale=1.0):
@@ -336,14 +365,16 @@ def csv2bvh_string(hierarchy_file, position_file, rotation_file, scale=1.0):
     # Get root positions.
     root_name = get_root_name(joint_info)
     pos_df, positions = get_transform_data(position_file)
-    positions *= scale
-    root_pos_df = [channel for channel in pos_df if root_name == channel.split('.')[0]]
+    # Get data indices for root position df in the same pass.
+    root_pos_indices = [idx for idx, channel in enumerate(pos_df) if root_name == channel.split('.')[0]]
+    root_pos_df = [pos_df[idx] for idx in root_pos_indices]
     if not root_pos_df:  # Make sure root is in position data.
         raise Exception("ERROR: No position data found in {} for hierarchy's root '{}'.\n"
                         "Make sure the names match. They are case-sensitive.".format(position_file, root_name))
     root_pos_channels = [channel.split('.')[1].upper() + "position" for channel in root_pos_df]
-    root_pos_indices = [pos_df.index(df) for df in root_pos_df]  # Get data indices for root position df.
+    # Only the root's positions are used, so only those get scaled.
     root_pos_data = positions[:, root_pos_indices]
+    root_pos_data *= scale
     n_frames = len(root_pos_data)
     
     # Get joint rotations.
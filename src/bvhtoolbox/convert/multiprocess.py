@@ -1,17 +1,94 @@
-import glob
 import os
 import sys
-from functools import wraps, partial
+import argparse
+import importlib
+from functools import wraps
 from multiprocessing import Pool, cpu_count
-from pickle import PicklingError
 import time
 
 
+# Function and further arguments of the worker process. Set once per process by _init_worker.
+_worker_fn = None
+_worker_args = tuple()
+_worker_kwargs = dict()
+
+
+def _init_worker(module_name, fn_name, args, kwargs):
+    """Set up a worker process with the original function behind a parallelized function.
+    The decorated function itself can't be pickled, because the module attribute is the wrapper.
+    The other arguments are the same for all files, so they are sent once per process, not with every file.
+    
+    :param module_name: Name of the module the function is defined in.
+    :type module_name: str
+    :param fn_name: Name of the decorated function.
+    :type fn_name: str
+    :param args: Positional arguments for the function following the file path.
+    :type args: tuple
+    :param kwargs: Keyword arguments for the function.
+    :type kwargs: dict
+    """
+    global _worker_fn, _worker_args, _worker_kwargs
+    _worker_fn = getattr(importlib.import_module(module_name), fn_name).__wrapped__
+    _worker_args = args
+    _worker_kwargs = kwargs
+
+
+def _call_worker(file_path):
+    """Process a single file in a worker process.
+    
+    :param file_path: File path to process.
+    :type file_path: str
+    :return: Result of the function.
+    """
+    return _worker_fn(file_path, *_worker_args, **_worker_kwargs)
+
+
+def _get_file_size(file_path):
+    """Return the size of a file in bytes, or 0 if it can't be accessed."""
+    try:
+        return os.path.getsize(file_path)
+    except OSError:
+        return 0
+
+
+def positive_int(value):
+    """Argument type for a number that must be at least 1, like the number of processes.
+
+    :param value: Command line argument.
+    :type value: str
+    :return: The number.
+    :rtype: int
+    """
+    try:
+        number = int(value)
+    except ValueError:
+        number = 0
+    if number < 1:
+        raise argparse.ArgumentTypeError("{} is not a positive integer.".format(value))
+    return number
+
+
+def add_jobs_argument(parser):
+    """Add the option for the number of processes to a command line parser.
+    Pass its value on to a parallelized function as n_jobs.
+
+    :param parser: Command line parser of a script that handles multiple files.
+    :type parser: argparse.ArgumentParser
+    """
+    parser.add_argument("-j", "--jobs", type=positive_int, help="Number of processes for multiple files.\n"
+                                                                "Defaults to the number of CPUs.")
+
+
 def parallelize(fn, *args):
     @wraps(fn)
     def wrapped(*args, **kwargs):
         # Keep track of when we started.
         t0 = time.time()
+        # Maximum number of processes for multiple files. It's not passed on to the function.
+        # None means one process per CPU.
+        n_jobs = kwargs.pop('n_jobs', None)
+        if n_jobs is not None and n_jobs < 1:
+            raise ValueError("n_jobs must be at least 1, got {}.".format(n_jobs))
         
         # Check if the first argument are multiple files.
         if isinstance(args[0], (list, tuple)):
@@ -22,24 +99,18 @@ def parallelize(fn, *args):
                 print("WARNING: No BVH files to convert.")
                 return False
             elif n_files == 1:
-                success = fn(args[0][0], **kwargs)
+                success = fn(args[0][0], *args[1:], **kwargs)
             else:
-                cpus = cpu_count()
+                cpus = n_jobs if n_jobs is not None else cpu_count()
                 n_processes = min(n_files, cpus)
-                partial_func = partial(fn, **kwargs)
-                try:
-                    print("\nCreating pool with {} processes.".format(n_processes))
-                    with Pool(processes=n_processes) as p:
-                        results = p.map(partial_func, args[0])  # FixMe: Can't pickle.
-                except PicklingError:
-                    print("WARNING: Known issue encountered with multiprocessing.\n"
-                          "Switching to sequential processing.")
-                    #results = list(map(partial_func, args[0]))
-                    # More verbose feedback.
-                    results = []
-                    for i, file in enumerate(args[0]):
-                        print("Converting file {}/{}: {}".format(i+1, len(args[0]), file))
-                        results.append(fn(file, **kwargs))
+                # Start with the largest files, so smaller ones fill up idle processes at the end.
+                files = sorted(args[0], key=_get_file_size, reverse=True)
+                print("\nCreating pool with {} processes.".format(n_processes))
+                # multiprocessing.Pool, because ProcessPoolExecutor only takes an initializer as of Python 3.7.
+                with Pool(processes=n_processes, initializer=_init_worker,
+                          initargs=(fn.__module__, fn.__name__, args[1:], kwargs)) as pool:
+                    # One file per task. Converting a file takes much longer than sending its path.
+                    results = pool.map(_call_worker, files, chunksize=1)
                     
                 # Were there errors?
                 num_errors = len(results) - sum(results)
@@ -48,15 +119,11 @@ def parallelize(fn, *args):
                 success = not num_errors
         else:  # Assume the first argument is a single file path.
             print("Converting 1 file...")
-            success = fn(args[0], **kwargs)
+            success = fn(args[0], *args[1:], **kwargs)
 
         print("Processing took: {:.2f} seconds".format(time.time() - t0))
         return success
 
-    # Trying to fix PicklingError.
-    #wrapped.__module__ = "__main__"  # For Python 2 only? Todo: Test in Python 2
-    #setattr(sys.modules[fn.__module__], fn.__name__, wrapped)  # Not working either.
-    
     return wrapped
 
 
@@ -68,7 +135,11 @@ def get_bvh_files(in_path):
     if os.path.isdir(in_path):
         os.chdir(in_path)
         # Collect all BVH files in folder and pair with out file as arguments for converter.
-        file_names = glob.glob("*.bvh")
+        # Like glob("*.bvh"), but without pattern matching. Hidden files are skipped just the same.
+        # parallelize sorts the files by size, so the order doesn't matter here.
+        with os.scandir('.') as entries:
+            file_names = [entry.name for entry in entries
+                          if entry.name.endswith('.bvh') and not entry.name.startswith('.') and entry.is_file()]
         return file_names
     else:
         return in_path
@@ -0,0 +1,51 @@
+"""Helpers for writing BVH files."""
+
+import os
+import shutil
+import tempfile
+from contextlib import contextmanager
+
+
+def _get_umask():
+    """Get the umask of the current process. It can only be read by setting it.
+
+    :return: The process' umask.
+    :rtype: int
+    """
+    umask = os.umask(0)
+    os.umask(umask)
+    return umask
+
+
+@contextmanager
+def replace_file(dst_file, buffering=-1):
+    """Write to a temporary file next to the destination and replace the destination with it when done.
+    This way a file can be overwritten while it is being read, and a failed write doesn't leave a broken file behind.
+    Symbolic links are followed, so the file they point to is replaced, not the link.
+    The destination keeps its permissions. A new file gets the default permissions for the current umask.
+
+    :param dst_file: Path of the file to write.
+    :type dst_file: str
+    :param buffering: Buffer size of the temporary file. Default is -1 for the system default.
+    :type buffering: int
+    :return: Handle of the temporary file, opened for writing text.
+    :rtype: typing.TextIO
+    """
+    dst_file = os.path.realpath(dst_file)
+    tmp_handle = tempfile.NamedTemporaryFile(mode='w', buffering=buffering, dir=os.path.dirname(dst_file),
+                                             suffix=os.path.splitext(dst_file)[1], delete=False)
+    try:
+        with tmp_handle:
+            yield tmp_handle
+        # NamedTemporaryFile creates files only the owner can read and write.
+        if os.path.exists(dst_file):
+            shutil.copymode(dst_file, tmp_handle.name)
+        else:
+            os.chmod(tmp_handle.name, 0o666 & ~_get_umask())
+        os.replace(tmp_handle.name, dst_file)
+    except BaseException:
+        try:
+            os.remove(tmp_handle.name)
+        except OSError:
+            pass
+        raise
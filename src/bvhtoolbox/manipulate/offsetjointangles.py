@@ -22,13 +22,16 @@
 import sys
 import csv
 import argparse
+import itertools
+from multiprocessing import cpu_count, freeze_support
+from concurrent.futures import ProcessPoolExecutor
 
 import numpy as np
-import transforms3d as t3d
 
 from .. import get_pkg_version
 from .. import BvhTree
-from .. import get_quaternions, get_motion_data, set_motion_data
+from .. import get_motion_data, set_motion_data, euler2quat_batch, qmult_batch, quat2euler_batch
+from ..convert.multiprocess import add_jobs_argument
 
 
 def add_angle_offsets(bvh_tree, angle_offsets):
@@ -45,15 +48,17 @@ def add_angle_offsets(bvh_tree, angle_offsets):
         print("WARNING: No rotation offsets. Aborting.")
         return
     
+    # Parse the motion data before channels get added to the hierarchy, while the frames still match it.
     frames = get_motion_data(bvh_tree)
-    # Convert the given euler angles to quaternions.
-    for joint_name, angle_values in angle_offsets.items():
+    # First pass: append missing rotation channels to the hierarchy of each joint and get the rotation order.
+    channel_orders = dict()
+    added_channels = dict()
+    for joint_name in angle_offsets.keys():
         try:
             joint = bvh_tree.get_joint(joint_name)
         except LookupError:
             print("WARNING: joint {} not found.".format(joint_name))
             continue
-            
         channel_names = bvh_tree.joint_channels(joint_name)
         # Find CHANNELS BvhNode.
         channel_node = joint.children[1]
@@ -63,16 +68,38 @@ def add_angle_offsets(bvh_tree, angle_offsets):
                 # Joint gets a new channel
                 channel_node.value.append(channel)
                 channel_node.value[1] = str(int(channel_node.value[1]) + 1)
-                # Insert new channel into frames.
-                insert_idx = bvh_tree.get_joint_channels_index(joint_name) + bvh_tree.get_joint_channel_index(joint_name, channel)
-                frames = np.insert(frames, insert_idx, 0.0, axis=1)  # Initialize with 0.
-        channel_order = 's' + ''.join([channel[:1].lower() for channel in channel_names if channel.endswith("rotation")])
-        angle_offset_quat = t3d.euler.euler2quat(*np.radians(angle_values), axes=channel_order)
-        joint_angles = get_quaternions(bvh_tree, joint_name, axes=channel_order)
-        new_angles = np.degrees([t3d.euler.quat2euler(t3d.quaternions.qmult(q, angle_offset_quat), axes=channel_order) for q in joint_angles])
-        # Replace frames with new values.
+                added_channels.setdefault(joint_name, list()).append(channel)
+        channel_orders[joint_name] = 's' + ''.join([channel[:1].lower() for channel in channel_names
+                                                     if channel.endswith("rotation")])
+    if added_channels:
+        bvh_tree.clear_caches()
+    
+    # Insert all new channels into frames at once, initialized with 0.
+    if added_channels:
+        new_cols = [bvh_tree.get_joint_channels_index(joint_name) + bvh_tree.get_joint_channel_index(joint_name, channel)
+                    for joint_name, channels in added_channels.items() for channel in channels]
+        new_frames = np.zeros((frames.shape[0], frames.shape[1] + len(new_cols)))
+        keep_cols = np.ones(new_frames.shape[1], dtype=bool)
+        keep_cols[new_cols] = False
+        new_frames[:, keep_cols] = frames
+        frames = new_frames
+    
+    # Convert all offsets to radians at once.
+    offsets_rad = np.radians(np.array([angle_offsets[joint_name] for joint_name in channel_orders], dtype=np.float64))
+    
+    # Second pass: add the rotation offsets.
+    for offset_rad, (joint_name, channel_order) in zip(offsets_rad, channel_orders.items()):
+        # A zero offset doesn't change the rotation. Missing channels were still added above.
+        if not offset_rad.any():
+            continue
         channels_idx = bvh_tree.get_joint_channels_index(joint_name)
-        rot_channels_idx = channels_idx + bvh_tree.get_joint_channel_index(joint_name, channel_names[0])
+        rot_channels_idx = channels_idx + bvh_tree.get_joint_channel_index(joint_name, channel_order[1].upper() + 'rotation')
+        # Convert the given euler angles to quaternions.
+        angle_offset_quat = euler2quat_batch(offset_rad[None], axes=channel_order)[0]
+        # Rotation channels in frames are already in channel order.
+        joint_angles = euler2quat_batch(np.radians(frames[:, rot_channels_idx: rot_channels_idx+3]), axes=channel_order)
+        new_angles = np.degrees(quat2euler_batch(qmult_batch(joint_angles, angle_offset_quat), axes=channel_order))
+        # Replace frames with new values.
         frames[:, rot_channels_idx: rot_channels_idx+3] = new_angles
     set_motion_data(bvh_tree, frames)
 
@@ -143,6 +170,7 @@ def main(argv=sys.argv[1:]):
     parser.add_argument("-o", "--out", nargs='*', type=str, help="Destination file paths for modified BVH files.\n"
                                                                  "If no out path is given, or list is shorter than\n"
                                                                  "input files, BVH files are overwritten.")
+    add_jobs_argument(parser)
     args = vars(parser.parse_args(argv))
     src_files_paths = args['input.bvh']
     dst_files_paths = args['out']
@@ -151,14 +179,18 @@ def main(argv=sys.argv[1:]):
     angles_file_path = args['angles.csv']
     angles = load_angle_offsets(angles_file_path)
 
-    res = list()
-    for i, bvh_file in enumerate(src_files_paths):
-        # There could be less destination paths or None.
-        if i >= len(dst_files_paths):
-            dst_file = None
-        else:
-            dst_file = dst_files_paths[i]
-        res.append(bvhfile_offset_angles(bvh_file, angles, dst_file))
+    # There could be less destination paths or None.
+    dst_files_paths = dst_files_paths[:len(src_files_paths)]
+    dst_files_paths += [None] * (len(src_files_paths) - len(dst_files_paths))
+    
+    n_jobs = args['jobs']
+    n_processes = min(len(src_files_paths), n_jobs if n_jobs is not None else cpu_count())
+    if n_processes > 1:
+        # Files are independent of each other, so process them in parallel.
+        with ProcessPoolExecutor(max_workers=n_processes) as executor:
+            res = list(executor.map(bvhfile_offset_angles, src_files_paths, itertools.repeat(angles), dst_files_paths))
+    else:
+        res = list(map(bvhfile_offset_angles, src_files_paths, itertools.repeat(angles), dst_files_paths))
 
     num_errors = len(res) - sum(res)
     if num_errors > 0:
@@ -167,5 +199,6 @@ def main(argv=sys.argv[1:]):
 
 
 if __name__ == "__main__":
+    freeze_support()
     exit_code = int(not main())
     sys.exit(exit_code)
@@ -3,6 +3,29 @@ import os
 import sys
 
 from .. import get_pkg_version
+from .file_helpers import replace_file
+
+# Frames are written line by line. A larger buffer than the default means fewer writes to disk.
+_WRITE_BUFFER_SIZE = 1 << 20
+
+
+def _keep_line(line_idx, frame1_idx, start, end=None):
+    """Whether a line of a BVH file is kept when removing frames from start to end.
+
+    :param line_idx: Index of the line in the file.
+    :type line_idx: int
+    :param frame1_idx: Index of the line holding the first frame.
+    :type frame1_idx: int
+    :param start: First frame to be deleted. Frame count starts with 1.
+    :type start: int
+    :param end: Last frame to be deleted. If None, all frames after start are removed.
+    :type end: int
+    :return: If the line is kept.
+    :rtype: bool
+    """
+    if line_idx < start + frame1_idx - 1:
+        return True
+    return bool(end) and line_idx >= end + frame1_idx
 
 
 def remove_frames(file_path, start, end=None, dst_file=None):
@@ -22,7 +45,7 @@ def remove_frames(file_path, start, end=None, dst_file=None):
     # Sanity Check on start and end.
     if end and (start >= end):
         print("First frame to remove is greater than last frame to remove. Aborting.\n"
-              "File: {]".format(file_path))
+              "File: {}".format(file_path))
         return False
 
     file_type = os.path.splitext(file_path)[1].lower()
@@ -30,33 +53,50 @@ def remove_frames(file_path, start, end=None, dst_file=None):
         print("ERROR: File extension BVH expected for: {}".format(file_path))
         return False
 
+    # The file is read twice line by line instead of keeping it in memory.
+    # First pass: find the first frame and count the frames we keep.
     try:
         with open(file_path, mode='r') as file_handle:
-            lines = file_handle.readlines()
+            frames_idx = None
+            orig_num_frames = None
+            num_frames = 0
+            for idx, line in enumerate(file_handle):
+                if frames_idx is None:
+                    if line.startswith('Frames:'):
+                        frames_idx = idx
+                        frame1_idx = frames_idx + 2
+                        try:
+                            orig_num_frames = int(line.split()[1])
+                        except (IndexError, ValueError):
+                            break
+                        # Don't bother reading the frames if the range is invalid.
+                        if start > orig_num_frames or (end and end > orig_num_frames):
+                            break
+                elif idx >= frame1_idx and _keep_line(idx, frame1_idx, start, end):
+                    num_frames += 1
     except FileNotFoundError:
         print("ERROR: file {} not found".format(file_path))
         return False
-
-    # Find first frame.
-    frames_idx = lines.index(next(line for line in lines if line.startswith('Frames:')))
-    frame1_idx = frames_idx + 2
-
-    # Slice together the parts we want to keep.
-    if end:
-        lines = lines[:start + frame1_idx - 1] + lines[end + frame1_idx:]
-    else:
-        lines = lines[:start + frame1_idx - 1]
-
-    # We need to update Frames:
-    num_frames = len(lines[frame1_idx:])
-    lines[frames_idx] = "Frames: {}\n".format(num_frames)
+    if orig_num_frames is None:
+        print("ERROR: Number of frames not found in {}".format(file_path))
+        return False
+    if start > orig_num_frames or (end and end > orig_num_frames):
+        print("ERROR: Frames to remove exceed the {} frames in {}".format(orig_num_frames, file_path))
+        return False
 
     # If no destination file is specified, overwrite input file.
     if not dst_file:
         dst_file = file_path
+    # Second pass: write the lines we keep to a temporary file that replaces the destination when done.
     try:
-        with open(dst_file, mode='w') as file_handle:
-            file_handle.writelines(lines)
+        with open(file_path, mode='r') as file_handle, \
+                replace_file(dst_file, buffering=_WRITE_BUFFER_SIZE) as tmp_handle:
+            for idx, line in enumerate(file_handle):
+                if idx == frames_idx:
+                    # We need to update Frames:
+                    tmp_handle.write("Frames: {}\n".format(num_frames))
+                elif _keep_line(idx, frame1_idx, start, end):
+                    tmp_handle.write(line)
     except OSError:
         print("ERROR: Can't write to destination {}".format(dst_file))
         return False
@@ -26,9 +26,10 @@ import os
 import sys
 import argparse
 import csv
-import re
+import shutil
 
 from .. import get_pkg_version
+from .file_helpers import replace_file
 
 
 def rename_joints(source_path, names_map, destination_path=None):
@@ -48,30 +49,32 @@ def rename_joints(source_path, names_map, destination_path=None):
         print("ERROR: File extension BVH expected for: {}".format(source_path))
         return False
 
+    # If no destination file is specified, overwrite input file.
+    if not destination_path:
+        destination_path = source_path
+    # Write to a temporary file that replaces the destination when done.
     try:
-        with open(source_path, mode='r') as file_handle:
-            lines = file_handle.readlines()
+        file_handle = open(source_path, mode='r')
     except FileNotFoundError:
         print("ERROR: file {} not found".format(source_path))
         return False
-
-    prog = re.compile("(?<=JOINT|ROOT ).*$")
-    
-    for idx, line in enumerate(lines):
-        if "MOTION\n" in line:
-            break
-        match = prog.search(line)
-        if match:
-            joint = match.group().lstrip()
-            if joint in names_map:
-                lines[idx] = line.replace(joint, names_map[joint])
-    
-    # If no destination file is specified, overwrite input file.
-    if not destination_path:
-        destination_path = source_path
     try:
-        with open(destination_path, mode='w') as file_handle:
-            file_handle.writelines(lines)
+        with file_handle, replace_file(destination_path) as tmp_handle:
+            for line in file_handle:
+                # Compare the keyword at the start of the line instead of searching the whole line.
+                items = line.split(None, 1)
+                if items and items[0] in ('JOINT', 'ROOT') and len(items) == 2:
+                    joint = items[1].rstrip()
+                    new_name = names_map.get(joint)
+                    if new_name is not None:
+                        # The name is at the end of the line. Only replace it there, not in the keyword.
+                        name_start = len(line) - len(items[1])
+                        line = line[:name_start] + new_name + line[name_start + len(joint):]
+                tmp_handle.write(line)
+                if items and items[0] == 'MOTION':
+                    # Only the hierarchy gets changed. Copy the motion section in bulk.
+                    shutil.copyfileobj(file_handle, tmp_handle)
+                    break
     except OSError:
         print("ERROR: Can't write to destination {}".format(destination_path))
         return False
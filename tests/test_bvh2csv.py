@@ -0,0 +1,39 @@
+import os
+
+import numpy as np
+import pytest
+
+from bvhtoolbox import BvhTree, get_affines
+from bvhtoolbox.convert.bvh2csv import write_joint_positions
+
+
+_EXAMPLE_FILES = os.path.join(os.path.dirname(__file__), 'example_files')
+
+
+def _get_world_positions(bvh_tree):
+    """Reference world positions of all joints including End Sites, one joint at a time (joints x frames x 3)."""
+    world_transforms = dict()
+    for joint in bvh_tree.get_joints(end_sites=True):
+        if joint.value[0] == 'End':
+            transforms = np.tile(np.eye(4), (bvh_tree.nframes, 1, 1))
+        else:
+            axes = 'r' + ''.join([channel[:1].lower() for channel in bvh_tree.joint_channels(joint.name)
+                                  if channel[1:] == 'rotation'])
+            transforms = get_affines(bvh_tree, joint.name, axes=axes)
+        if joint.parent is not bvh_tree.root:
+            transforms[:, :3, 3] = [float(offset) for offset in joint['OFFSET']]
+            transforms = np.matmul(world_transforms[joint.parent.name], transforms)
+        world_transforms[joint.name] = transforms
+    return np.array([transforms[:, :3, 3] for transforms in world_transforms.values()])
+
+
+@pytest.mark.parametrize('file_name', ['test_freebvh.bvh', 'test_mocapbank.bvh'])
+def test_write_joint_positions_scale(file_name, tmp_path):
+    with open(os.path.join(_EXAMPLE_FILES, file_name)) as file_handle:
+        mocap = BvhTree(file_handle.read())
+    scale = 2.5
+    csv_path = str(tmp_path / 'positions.csv')
+    assert write_joint_positions(mocap, csv_path, scale=scale, end_sites=True)
+    positions = np.loadtxt(csv_path, delimiter=',', skiprows=1)[:, 1:]
+    expected = _get_world_positions(mocap) * scale
+    assert np.allclose(positions, expected.transpose(1, 0, 2).reshape(mocap.nframes, -1), atol=1e-4)
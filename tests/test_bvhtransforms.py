@@ -1,4 +1,4 @@
-import collections
+import collections.abc
 
 from hypothesis import given
 from hypothesis import example
@@ -7,10 +7,55 @@ from hypothesis import strategies as st
 from hypothesis.extra.numpy import arrays
 import pytest
 import numpy as np
-import bvhtoolbox as bt
+import transforms3d as t3d
+import bvhtoolbox.bvhtransforms as bt
+from bvhtoolbox import BvhTree
 
+# Rotation orders for sampling, listed once.
+_AXES_KEYS = list(bt._AXES2TUPLE.keys())
+# Rotation orders with static or rotating frame prefix.
+_AXES = st.sampled_from([f + a for f in 'sr' for a in _AXES_KEYS])
+# Batches of Euler angles in radians.
+_ANGLES = arrays(dtype=np.float64,
+                 shape=st.tuples(st.integers(min_value=1, max_value=50), st.just(3)),
+                 elements=st.floats(min_value=-np.pi, max_value=np.pi))
 
-@given(a=arrays(dtype=np.float,
+# Joints with different rotation orders. Neck lacks the Yrotation channel.
+_PARTIAL_CHANNELS_HIERARCHY = """HIERARCHY
+ROOT Hips
+{
+    OFFSET 0.0 0.0 0.0
+    CHANNELS 6 Xposition Yposition Zposition Zrotation Xrotation Yrotation
+    JOINT Chest
+    {
+        OFFSET 0.0 10.0 0.0
+        CHANNELS 3 Yrotation Xrotation Zrotation
+        JOINT Neck
+        {
+            OFFSET 0.0 10.0 0.0
+            CHANNELS 2 Zrotation Xrotation
+            End Site
+            {
+                OFFSET 0.0 5.0 0.0
+            }
+        }
+    }
+}
+MOTION
+Frames: 5
+Frame Time: 0.033333
+"""
+# Rotation orders to expect for the joints in the hierarchy above.
+_PARTIAL_CHANNELS_AXES = {'Hips': 'rzxy', 'Chest': 'ryxz', 'Neck': 'rzxy'}
+
+
+def _get_partial_channels_tree():
+    frames = np.random.RandomState(0).uniform(-180.0, 180.0, (5, 11))
+    motion = '\n'.join([' '.join(map(str, frame)) for frame in frames])
+    return BvhTree(_PARTIAL_CHANNELS_HIERARCHY + motion)
+
+
+@given(a=arrays(dtype=np.float64,
                 shape=st.tuples(st.integers(min_value=0, max_value=600),
                                 st.integers(min_value=0, max_value=100)),
                 elements=st.floats(allow_nan=False)),
@@ -21,36 +66,35 @@ def test_prune(a, epsilon):
     assert np.all((a == 0.0) | (epsilon <= np.abs(a)))
 
 
-@given(order=st.text().filter(lambda x: x not in bt._AXES2TUPLE.keys()))
+@given(order=st.text().filter(lambda x: x not in _AXES_KEYS))
 def test_get_reordered_indices_invalid_input(order):
     with pytest.raises(KeyError):
         res = bt._get_reordered_indices(order)
 
 
-@given(order=st.sampled_from(list(bt._AXES2TUPLE.keys())))
+@given(order=st.sampled_from(_AXES_KEYS))
 def test_get_reordered_indices(order):
     res = bt._get_reordered_indices(order)
-    assert isinstance(res, collections.Iterable)
+    assert isinstance(res, collections.abc.Iterable)
     assert sorted(res) == [0, 1, 2]
     
     
-@given(a=arrays(dtype=np.float,
-                shape=tuple(np.random.randint(1, 5) for _ in range(np.random.randint(1, 4))),
+@given(a=arrays(dtype=np.float64,
+                shape=st.lists(st.integers(min_value=1, max_value=4), min_size=1, max_size=3).map(tuple).filter(
+                    lambda shape: shape[-1] != 3 or len(shape) > 2),
                 elements=st.floats(allow_nan=False)),
-       axes=st.sampled_from(list(bt._AXES2TUPLE.keys())))
+       axes=st.sampled_from(_AXES_KEYS))
 def test_reorder_axes_invalid_dimensionality(a, axes):
-    with pytest.raises(NotImplementedError):
+    with pytest.raises(ValueError):
         bt.reorder_axes(a, axes=axes)
 
 
-# @given(a=arrays(dtype=np.float,
-#                 shape=st.one_of(st.just(3),st.tuples(st.integers(min_value=1), st.just(3))),
-#                 elements=st.floats(allow_nan=False, allow_infinity=False),
-#                 unique=True),
-#        axes=st.sampled_from(list(bt._AXES2TUPLE.keys())))
-@given(axes=st.sampled_from(list(bt._AXES2TUPLE.keys())))
-@example(a=np.random.random((10, 3)))
-@example(a=np.random.random(3))
+@given(a=arrays(dtype=np.float64,
+                shape=st.one_of(st.just(3), st.tuples(st.integers(min_value=1, max_value=50), st.just(3))),
+                elements=st.floats(allow_nan=False, allow_infinity=False)),
+       axes=st.sampled_from(_AXES_KEYS))
+@example(a=np.random.random((10, 3)), axes='zxy')
+@example(a=np.random.random(3), axes='zxy')
 def test_reorder_axes(a, axes):
     res = bt.reorder_axes(a, axes=axes)
     assert isinstance(res, np.ndarray)
@@ -58,6 +102,56 @@ def test_reorder_axes(a, axes):
 # Todo: output should be reordered.
 
 
+@given(angles=_ANGLES, axes=_AXES)
+def test_quat2euler_batch(angles, axes):
+    quats = np.array([t3d.euler.euler2quat(*a, axes=axes) for a in angles])
+    expected = np.array([t3d.euler.quat2euler(q, axes=axes) for q in quats])
+    assert np.allclose(bt.quat2euler_batch(quats, axes=axes), expected)
+
+
+@given(angles=_ANGLES,
+       offset=arrays(dtype=np.float64, shape=3, elements=st.floats(min_value=-np.pi, max_value=np.pi)))
+def test_qmult_batch(angles, offset):
+    quats = np.array([t3d.euler.euler2quat(*a) for a in angles])
+    q = t3d.euler.euler2quat(*offset)
+    expected = np.array([t3d.quaternions.qmult(quat, q) for quat in quats])
+    assert np.allclose(bt.qmult_batch(quats, q), expected)
+
+
+@given(angles=_ANGLES, axes=_AXES)
+def test_euler2quat_batch(angles, axes):
+    quats = bt.euler2quat_batch(angles, axes=axes)
+    expected = np.array([t3d.euler.euler2quat(*a, axes=axes) for a in angles])
+    assert quats.flags['C_CONTIGUOUS']
+    assert np.allclose(quats, expected)
+
+
+@given(angles=_ANGLES, axes=_AXES)
+def test_euler2mat_batch(angles, axes):
+    expected = np.array([t3d.euler.euler2mat(*a, axes=axes) for a in angles])
+    assert np.allclose(bt.euler2mat_batch(angles, axes=axes), expected)
+
+
+def test_get_all_rotation_matrices():
+    mocap = _get_partial_channels_tree()
+    matrices = bt.get_all_rotation_matrices(mocap)
+    assert matrices.shape == (3, 5, 3, 3)
+    for idx, joint_name in enumerate(mocap.get_joints_names()):
+        expected = bt.get_rotation_matrices(mocap, joint_name, axes=_PARTIAL_CHANNELS_AXES[joint_name])
+        assert np.allclose(matrices[idx], expected)
+
+
+@pytest.mark.parametrize('axes', [None, 'rzxy', 'sxyz'])
+def test_get_all_quaternions(axes):
+    mocap = _get_partial_channels_tree()
+    quaternions = bt.get_all_quaternions(mocap, axes=axes)
+    assert quaternions.shape == (3, 5, 4)
+    for idx, joint_name in enumerate(mocap.get_joints_names()):
+        joint_axes = _PARTIAL_CHANNELS_AXES[joint_name] if axes is None else axes
+        expected = bt.get_quaternions(mocap, joint_name, axes=joint_axes)
+        assert np.allclose(quaternions[idx], expected)
+
+
 if __name__ == '__main__':
     test_prune()
     test_get_reordered_indices_invalid_input()
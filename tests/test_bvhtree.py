@@ -0,0 +1,53 @@
+import numpy as np
+import pytest
+
+from bvhtoolbox import BvhTree
+
+
+_HIERARCHY = """HIERARCHY
+ROOT Hips
+{
+    OFFSET 0.0 0.0 0.0
+    CHANNELS 6 Xposition Yposition Zposition Zrotation Xrotation Yrotation
+    JOINT Chest
+    {
+        OFFSET 0.0 10.0 0.0
+        CHANNELS 3 Zrotation Xrotation Yrotation
+        End Site
+        {
+            OFFSET 0.0 5.0 0.0
+        }
+    }
+}
+MOTION
+Frames: 2
+Frame Time: 0.033333
+"""
+
+
+def test_motion_data():
+    mocap = BvhTree(_HIERARCHY + "0 1 2 3 4 5 6 7 8\n\n9 10 11 12 13 14 15 16 17\n")
+    assert mocap.motion_data.shape == (2, 9)
+    assert np.array_equal(mocap.motion_data.ravel(), np.arange(18))
+
+
+def test_motion_data_no_frames():
+    mocap = BvhTree(_HIERARCHY)
+    assert mocap.motion_data.shape == (0, 9)
+
+
+@pytest.mark.parametrize('motion', [
+    "0 1 2 3 4 5 6 7\n8 9 10 11 12 13 14 15 16 17\n",  # Short row followed by a long row, same total.
+    "0 1 2 3 4 5 6 7\n9 10 11 12 13 14 15 16\n",  # Short rows.
+    "0 1 2 3 4 5 6 7 8 9\n10 11 12 13 14 15 16 17 18 19\n",  # Long rows.
+])
+def test_motion_data_invalid_row_length(motion):
+    mocap = BvhTree(_HIERARCHY + motion)
+    with pytest.raises(ValueError):
+        mocap.motion_data
+
+
+def test_motion_data_non_numeric():
+    mocap = BvhTree(_HIERARCHY + "0 1 2 3 4 5 6 7 8\n9 10 11 12 x 14 15 16 17\n")
+    with pytest.raises(ValueError):
+        mocap.motion_data
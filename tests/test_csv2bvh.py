@@ -0,0 +1,24 @@
+import numpy as np
+import pytest
+
+from bvhtoolbox.convert.csv2bvh import get_transform_data
+
+
+def _write_csv(tmp_path, text):
+    csv_path = tmp_path / 'transforms.csv'
+    csv_path.write_text(text)
+    return str(csv_path)
+
+
+def test_get_transform_data(tmp_path):
+    csv_path = _write_csv(tmp_path, "time,Hips.x,Hips.y\n0.0,1.0,2.0\n0.1,3.0,4.0\n")
+    columns, data = get_transform_data(csv_path)
+    assert columns == ['time', 'Hips.x', 'Hips.y']
+    assert np.array_equal(data, [[0.0, 1.0, 2.0], [0.1, 3.0, 4.0]])
+
+
+def test_get_transform_data_ragged_rows(tmp_path):
+    # Same number of values as two full rows, but they must not be shifted into the first row.
+    csv_path = _write_csv(tmp_path, "time,Hips.x,Hips.y\n0.0,1.0\n0.1,2.0,3.0,4.0\n")
+    with pytest.raises(ValueError):
+        get_transform_data(csv_path)
@@ -0,0 +1,57 @@
+import numpy as np
+import transforms3d as t3d
+
+from bvhtoolbox import BvhTree
+from bvhtoolbox.manipulate import add_angle_offsets
+
+
+# Chest lacks the Yrotation channel.
+_HIERARCHY = """HIERARCHY
+ROOT Hips
+{
+    OFFSET 0.0 0.0 0.0
+    CHANNELS 6 Xposition Yposition Zposition Zrotation Xrotation Yrotation
+    JOINT Chest
+    {
+        OFFSET 0.0 10.0 0.0
+        CHANNELS 2 Zrotation Xrotation
+        End Site
+        {
+            OFFSET 0.0 5.0 0.0
+        }
+    }
+}
+MOTION
+Frames: 3
+Frame Time: 0.033333
+"""
+
+
+def _get_tree():
+    frames = np.random.RandomState(0).uniform(-90.0, 90.0, (3, 8))
+    motion = '\n'.join([' '.join(map(str, frame)) for frame in frames])
+    return BvhTree(_HIERARCHY + motion), frames
+
+
+def test_add_angle_offsets_missing_channel():
+    mocap, frames = _get_tree()
+    offset = (10.0, -20.0, 30.0)
+    add_angle_offsets(mocap, {'Chest': offset})
+    assert mocap.joint_channels('Chest') == ['Zrotation', 'Xrotation', 'Yrotation']
+    motion_data = mocap.motion_data
+    assert motion_data.shape == (3, 9)
+    # Other joints are untouched.
+    assert np.allclose(motion_data[:, :6], frames[:, :6])
+    offset_quat = t3d.euler.euler2quat(*np.radians(offset), axes='szxy')
+    for frame, new_frame in zip(frames, motion_data):
+        # The new Yrotation channel starts at 0.
+        quat = t3d.euler.euler2quat(*np.radians([frame[6], frame[7], 0.0]), axes='szxy')
+        expected = np.degrees(t3d.euler.quat2euler(t3d.quaternions.qmult(quat, offset_quat), axes='szxy'))
+        assert np.allclose(new_frame[6:], expected)
+
+
+def test_add_angle_offsets_zero_offset():
+    mocap, frames = _get_tree()
+    add_angle_offsets(mocap, {'Chest': (0.0, 0.0, 0.0)})
+    # The missing channel is still added.
+    assert np.allclose(mocap.motion_data, np.insert(frames, 8, 0.0, axis=1))
@@ -0,0 +1,120 @@
+import os
+import stat
+
+import numpy as np
+import pytest
+
+from bvhtoolbox import BvhTree
+from bvhtoolbox.manipulate import remove_frames
+from bvhtoolbox.manipulate.file_helpers import replace_file
+
+
+_HIERARCHY = """HIERARCHY
+ROOT Hips
+{
+    OFFSET 0.0 0.0 0.0
+    CHANNELS 6 Xposition Yposition Zposition Zrotation Xrotation Yrotation
+    JOINT Chest
+    {
+        OFFSET 0.0 10.0 0.0
+        CHANNELS 3 Zrotation Xrotation Yrotation
+        End Site
+        {
+            OFFSET 0.0 5.0 0.0
+        }
+    }
+}
+MOTION
+Frames: 6
+Frame Time: 0.033333
+"""
+# Each frame holds its own number in all channels.
+_MOTION_DATA = np.repeat(np.arange(1.0, 7.0)[:, None], 9, axis=1)
+
+
+def _write_bvh(file_path):
+    motion = '\n'.join([' '.join(map(str, frame)) for frame in _MOTION_DATA])
+    with open(file_path, 'w') as file_handle:
+        file_handle.write(_HIERARCHY + motion + '\n')
+
+
+def _read_bvh(file_path):
+    with open(file_path) as file_handle:
+        return BvhTree(file_handle.read())
+
+
+def _get_mode(file_path):
+    return stat.S_IMODE(os.stat(file_path).st_mode)
+
+
+def test_remove_frames_middle_range(tmp_path):
+    bvh_path = str(tmp_path / 'test.bvh')
+    _write_bvh(bvh_path)
+    assert remove_frames(bvh_path, 2, 4)
+    mocap = _read_bvh(bvh_path)
+    assert mocap.nframes == 3
+    assert np.array_equal(mocap.motion_data, np.delete(_MOTION_DATA, [1, 2, 3], axis=0))
+
+
+def test_remove_frames_to_end(tmp_path):
+    bvh_path = str(tmp_path / 'test.bvh')
+    dst_path = str(tmp_path / 'out.bvh')
+    _write_bvh(bvh_path)
+    assert remove_frames(bvh_path, 5, dst_file=dst_path)
+    assert np.array_equal(_read_bvh(dst_path).motion_data, _MOTION_DATA[:4])
+
+
+@pytest.mark.parametrize('start, end', [(2, 7), (7, None), (4, 2)])
+def test_remove_frames_invalid_range(tmp_path, start, end):
+    bvh_path = str(tmp_path / 'test.bvh')
+    _write_bvh(bvh_path)
+    with open(bvh_path) as file_handle:
+        original = file_handle.read()
+    assert not remove_frames(bvh_path, start, end)
+    with open(bvh_path) as file_handle:
+        assert file_handle.read() == original
+    assert os.listdir(str(tmp_path)) == ['test.bvh']
+
+
+def test_remove_frames_keeps_mode(tmp_path):
+    bvh_path = str(tmp_path / 'test.bvh')
+    _write_bvh(bvh_path)
+    os.chmod(bvh_path, 0o644)
+    assert remove_frames(bvh_path, 2, 4)
+    assert _get_mode(bvh_path) == 0o644
+
+
+def test_remove_frames_symlink(tmp_path):
+    bvh_path = str(tmp_path / 'test.bvh')
+    link_path = str(tmp_path / 'link.bvh')
+    _write_bvh(bvh_path)
+    os.symlink(bvh_path, link_path)
+    assert remove_frames(link_path, 2, 4)
+    # The link still points to the file, which got changed.
+    assert os.path.islink(link_path)
+    assert _read_bvh(bvh_path).nframes == 3
+
+
+def test_replace_file_new_file(tmp_path):
+    file_path = str(tmp_path / 'new.bvh')
+    with replace_file(file_path) as file_handle:
+        file_handle.write('test')
+    umask = os.umask(0)
+    os.umask(umask)
+    assert _get_mode(file_path) == 0o666 & ~umask
+    with open(file_path) as file_handle:
+        assert file_handle.read() == 'test'
+
+
+def test_replace_file_error(tmp_path):
+    file_path = str(tmp_path / 'test.bvh')
+    with open(file_path, 'w') as file_handle:
+        file_handle.write('original')
+    with pytest.raises(RuntimeError):
+        with replace_file(file_path) as file_handle:
+            file_handle.write('broken')
+            raise RuntimeError
+    # The destination is unchanged and the temporary file is gone.
+    with open(file_path) as file_handle:
+        assert file_handle.read() == 'original'
+    assert os.listdir(str(tmp_path)) == ['test.bvh']
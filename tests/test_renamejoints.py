@@ -0,0 +1,58 @@
+from bvhtoolbox import BvhTree
+from bvhtoolbox.manipulate import rename_joints
+
+
+# The name of joint O is part of the keywords ROOT and JOINT.
+_BVH = """HIERARCHY
+ROOT Hips
+{
+    OFFSET 0.0 0.0 0.0
+    CHANNELS 6 Xposition Yposition Zposition Zrotation Xrotation Yrotation
+    JOINT Chest
+    {
+        OFFSET 0.0 10.0 0.0
+        CHANNELS 3 Zrotation Xrotation Yrotation
+        JOINT O
+        {
+            OFFSET 0.0 5.0 0.0
+            CHANNELS 3 Zrotation Xrotation Yrotation
+            End Site
+            {
+                OFFSET 0.0 5.0 0.0
+            }
+        }
+    }
+}
+MOTION
+Frames: 2
+Frame Time: 0.033333
+0.0 1.0 2.0 3.0 4.0 5.0 6.0 7.0 8.0 9.0 10.0 11.0
+12.0 13.0 14.0 15.0 16.0 17.0 18.0 19.0 20.0 21.0 22.0 23.0
+"""
+
+
+def _rename(tmp_path, names_map):
+    src_path = str(tmp_path / 'test.bvh')
+    dst_path = str(tmp_path / 'out.bvh')
+    with open(src_path, 'w') as file_handle:
+        file_handle.write(_BVH)
+    assert rename_joints(src_path, names_map, dst_path)
+    with open(dst_path) as file_handle:
+        return file_handle.read()
+
+
+def test_rename_joints(tmp_path):
+    text = _rename(tmp_path, {'Hips': 'Pelvis', 'Chest': 'Spine'})
+    assert BvhTree(text).get_joints_names() == ['Pelvis', 'Spine', 'O']
+    assert 'ROOT Pelvis\n' in text
+    assert 'JOINT Spine\n' in text
+    assert 'JOINT O\n' in text
+    # Only the names changed, the MOTION section is copied as is.
+    assert text == _BVH.replace('Hips', 'Pelvis').replace('Chest', 'Spine')
+    assert text[text.index('MOTION'):] == _BVH[_BVH.index('MOTION'):]
+
+
+def test_rename_joints_keyword_substring(tmp_path):
+    text = _rename(tmp_path, {'O': 'Neck'})
+    assert BvhTree(text).get_joints_names() == ['Hips', 'Chest', 'Neck']
+    assert text == _BVH.replace('JOINT O\n', 'JOINT Neck\n')